@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from boxes import Detections
+from detectweapons import ThreatDetectionSystem
+from motion import MotionDetector
+
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.webm', '.mpg', '.mpeg', '.ts')
+
+
+def find_videos(paths: List[str]) -> List[str]:
+   """Expand files and directories (recursively) into a sorted list of video files"""
+   videos = []
+   for path in paths:
+       if os.path.isdir(path):
+           for root, _, names in os.walk(path):
+               videos.extend(os.path.join(root, n) for n in names if n.lower().endswith(VIDEO_EXTENSIONS))
+       elif os.path.isfile(path):
+           videos.append(path)
+       else:
+           raise SystemExit(f"No such file or directory: {path}")
+   return sorted(set(videos))
+
+
+def iter_frames(path: str, stride: int, start_frame: int = 0, scene_threshold: Optional[float] = None,
+                max_gap: float = 10.0) -> Iterator[Tuple[int, float, np.ndarray]]:
+   """Yield (frame index, seconds into the file, BGR frame) for sampled frames only.
+
+   Frames whose index is a multiple of ``stride`` are candidates; the rest are
+   grabbed without being decoded. With ``scene_threshold`` a candidate is only
+   yielded when its motion score reaches the threshold or ``max_gap`` seconds
+   passed since the last yielded frame, so static stretches cost one thumbnail
+   per candidate.
+   """
+   capture = cv2.VideoCapture(path)
+   if not capture.isOpened():
+       logger.error("Could not open %s", path)
+       return
+   fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+   if start_frame:
+       capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+   motion = MotionDetector() if scene_threshold is not None else None
+   last_yield = None
+   index = start_frame
+   try:
+       while True:
+           if index % stride:
+               if not capture.grab():
+                   break
+               index += 1
+               continue
+           ok, frame = capture.read()
+           if not ok:
+               break
+           seconds = index / fps
+           if motion is not None:
+               score = motion.update(frame)
+               if score < scene_threshold and last_yield is not None and seconds - last_yield < max_gap:
+                   index += 1
+                   continue
+           last_yield = seconds
+           yield index, seconds, frame
+           index += 1
+   finally:
+       capture.release()
+
+
+class Checkpoint:
+   """Per-file progress plus the output size it matches, written atomically after every batch.
+
+   On resume the output is truncated back to the recorded size, so rows written
+   after the last checkpoint are not duplicated.
+   """
+
+   def __init__(self, path: str):
+       self.path = path
+       self.files: Dict[str, Dict] = {}
+       self.output_bytes = 0
+       if os.path.exists(path):
+           with open(path) as f:
+               state = json.load(f)
+           self.files = state.get('files', {})
+           self.output_bytes = state.get('output_bytes', 0)
+
+   def reset(self) -> None:
+       self.files = {}
+       self.output_bytes = 0
+
+   def next_frame(self, video: str) -> Optional[int]:
+       """Frame to resume a file from, or None if it is already finished"""
+       progress = self.files.get(video)
+       if progress is None:
+           return 0
+       return None if progress.get('done') else progress['frame'] + 1
+
+   def save(self, output_bytes: int) -> None:
+       self.output_bytes = output_bytes
+       tmp_path = f"{self.path}.tmp"
+       with open(tmp_path, 'w') as f:
+           json.dump({'files': self.files, 'output_bytes': output_bytes}, f)
+       # Rename last so an interrupted write never leaves a partial checkpoint
+       os.replace(tmp_path, self.path)
+
+
+def compact_threats(detections: Detections, queries: List[Dict]) -> List[Dict]:
+   """Frame-normalized boxes rounded to 4 places keep rows short and resolution independent"""
+   return [
+       {'type': queries[cls]['type'], 'level': queries[cls]['level'], 'confidence': score, 'bbox': bbox}
+       for bbox, score, cls in zip(np.round(detections.boxes, 4).tolist(),
+                                   np.round(detections.scores, 3).tolist(),
+                                   detections.classes.tolist())
+   ]
+
+
+def analyze(detector: ThreatDetectionSystem, videos: List[str], output_path: str, checkpoint: Checkpoint,
+            stride: int, batch_size: int, open_files: int, scene_threshold: Optional[float],
+            max_gap: float, write_empty: bool) -> Dict:
+   """Interleave sampled frames from several files into model batches and append JSONL rows"""
+   output_size = os.path.getsize(output_path) if os.path.exists(output_path) else None
+   if checkpoint.files and (output_size is None or output_size < checkpoint.output_bytes):
+       # Rows the checkpoint counts as written are gone; truncate() would pad the file with NULs
+       logger.warning("%s is missing or shorter than its checkpoint, starting over", output_path)
+       checkpoint.reset()
+   pending = [v for v in videos if checkpoint.next_frame(v) is not None]
+   active: List[Tuple[str, Iterator]] = []
+   totals = {'files': len(pending), 'frames': 0, 'detections': 0, 'batches': 0}
+   start_time = time.time()
+
+   mode = 'r+b' if output_size is not None and checkpoint.files else 'wb'
+   with open(output_path, mode) as output:
+       # Drop rows written after the last checkpoint
+       output.truncate(checkpoint.output_bytes)
+       output.seek(checkpoint.output_bytes)
+
+       while pending or active:
+           while pending and len(active) < open_files:
+               video = pending.pop(0)
+               frames = iter_frames(video, stride, checkpoint.next_frame(video), scene_threshold, max_gap)
+               active.append((video, frames))
+               checkpoint.files.setdefault(video, {'frame': -1, 'done': False})
+
+           # Round-robin across open files so every batch mixes footage
+           batch = []
+           while len(batch) < batch_size and active:
+               for video, frames in list(active):
+                   item = next(frames, None)
+                   if item is None:
+                       active.remove((video, frames))
+                       checkpoint.files[video]['done'] = True
+                       continue
+                   batch.append((video,) + item)
+                   if len(batch) >= batch_size:
+                       break
+
+           if batch:
+               images = [detector.prepare_image(frame) for _, _, _, frame in batch]
+               results = [detector.postprocess(d) for d in detector.detect_batch(images)]
+               for (video, index, seconds, _), threats in zip(batch, results):
+                   if len(threats) or write_empty:
+                       row = {
+                           'file': video,
+                           'frame': index,
+                           't': round(seconds, 3),
+                           'threats': compact_threats(threats, detector.threat_queries),
+                       }
+                       output.write(json.dumps(row, separators=(',', ':')).encode('utf-8') + b'\n')
+                   checkpoint.files[video]['frame'] = index
+                   totals['detections'] += len(threats)
+               totals['frames'] += len(batch)
+               totals['batches'] += 1
+
+           output.flush()
+           os.fsync(output.fileno())
+           checkpoint.save(output.tell())
+           if batch and totals['batches'] % 20 == 0:
+               logger.info("%d frames analyzed (%.1f fps)", totals['frames'],
+                           totals['frames'] / max(time.time() - start_time, 1e-6))
+
+   totals['seconds'] = time.time() - start_time
+   return totals
+
+
+def main(argv: List[str] = None) -> int:
+   parser = argparse.ArgumentParser(description="Scan recorded footage for threats and write detections as JSONL")
+   parser.add_argument('paths', nargs='+', help="Video files or directories to scan")
+   parser.add_argument('--output', '-o', required=True, help="JSONL file with one row per analyzed frame")
+   parser.add_argument('--checkpoint', help="Progress file for resuming (default: OUTPUT.ckpt)")
+   parser.add_argument('--stride', type=int, default=15, help="Analyze every Nth frame")
+   parser.add_argument('--scene-change', type=float, default=None,
+                       help="Only analyze strided frames whose motion score reaches this fraction")
+   parser.add_argument('--max-gap', type=float, default=10.0,
+                       help="With --scene-change, analyze at least one frame per this many seconds")
+   parser.add_argument('--batch-size', type=int, default=8)
+   parser.add_argument('--open-files', type=int, default=4, help="Files read concurrently to fill batches")
+   parser.add_argument('--write-empty', action='store_true', help="Also write rows for frames without threats")
+   parser.add_argument('--precision', default=None)
+   args = parser.parse_args(argv)
+
+   videos = find_videos(args.paths)
+   if not videos:
+       raise SystemExit("No video files found")
+   checkpoint = Checkpoint(args.checkpoint or f"{args.output}.ckpt")
+   detector = ThreatDetectionSystem(precision=args.precision)
+   totals = analyze(
+       detector, videos, args.output, checkpoint,
+       stride=max(1, args.stride),
+       batch_size=max(1, args.batch_size),
+       open_files=max(1, args.open_files),
+       scene_threshold=args.scene_change,
+       max_gap=args.max_gap,
+       write_empty=args.write_empty,
+   )
+   print(json.dumps(totals, indent=2))
+   return 0
+
+
+if __name__ == '__main__':
+   sys.exit(main())
@@ -1,12 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import os
 import base64
+import functools
+import threading
 import logging
 import json
 import time
 from dotenv import load_dotenv
-from detectweapons import ThreatDetectionSystem
+from detectweapons import ThreatDetectionSystem, MODEL_REVISION
+from scheduler import InferenceScheduler
+from cpu_pool import CpuReplicaPool
+from ingest import IngestionManager, parse_list, parse_sources
+from publisher import ResultPublisher
+import metrics
+import stages
+from structured_logging import configure_logging
 import torch
 
 
@@ -14,8 +23,8 @@ import torch
 load_dotenv()
 
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging (LOG_FORMAT=json for structured records, sampled per camera)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -24,14 +33,313 @@ app = Flask(__name__)
 CORS(app, resources={
     r"/api/*": {
         "origins": ["http://localhost:3000"],  # Allow requests from frontend
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"],
+        "methods": ["GET", "POST", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "X-Camera-Id", "X-Trace"],
+        "expose_headers": ["X-Threats", "X-Trace"],
     }
 })
 
 
-# Initialize threat detection system
-threat_detector = ThreatDetectionSystem()
+# Threat detection system, loaded on a background thread so the HTTP server starts immediately
+threat_detector = None
+# Optional CpuReplicaPool serving inference from separate processes
+cpu_pool = None
+_detector_lock = threading.Lock()
+# Server-side stream readers (STREAM_SOURCES or /api/streams) and their latest results
+ingestion = None
+# Every SSE subscriber holds an HTTP thread, so keep most of HTTP_THREADS free for /api/detect
+publisher = ResultPublisher(max_subscribers=int(os.getenv('EVENTS_MAX_SUBSCRIBERS', 8)))
+# Clients may only start and stop streams when STREAM_ALLOW_RUNTIME=1, and only for allowlisted hosts
+STREAM_ALLOW_RUNTIME = os.getenv('STREAM_ALLOW_RUNTIME') == '1'
+# Seconds between SSE keepalive comments on an idle subscription
+EVENTS_KEEPALIVE = float(os.getenv('EVENTS_KEEPALIVE', 15))
+# Model lifecycle reported by /api/health: idle -> loading -> warming -> ready (or error)
+model_status = {'state': 'idle', 'load_seconds': None, 'error': None}
+
+# Directory for the pre-serialized weights shared by CPU replicas
+WEIGHTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'weights')
+
+
+def default_weights_cache(detector):
+    """Weights file for the detector's precision; int8 models quantize fp32 weights at load time"""
+    storage = 'fp32' if detector.precision == 'int8' else detector.precision
+    return os.path.join(WEIGHTS_DIR, f'moondream2-{MODEL_REVISION}-{storage}.pt')
+
+
+def start_detector():
+    """Begin loading the model on a background thread; returns immediately"""
+    with _detector_lock:
+        if model_status['state'] != 'idle':
+            return
+        model_status['state'] = 'loading'
+    threading.Thread(target=_load_detector, name='model-loader', daemon=True).start()
+
+
+def get_detector():
+    """Return the detector if it is ready, kicking off the background load on first use"""
+    if threat_detector is None:
+        start_detector()
+    return threat_detector
+
+
+def _load_detector():
+    """Load the model once per process and attach the shared inference worker pool"""
+    global threat_detector
+    start_time = time.time()
+    try:
+        # WEIGHTS_CACHE memory-maps a pre-serialized state dict instead of going through from_pretrained
+        weights_cache = os.getenv('WEIGHTS_CACHE')
+        detector = ThreatDetectionSystem(initialize=False, weights_path=weights_cache)
+        cpu_replicas = int(os.getenv('CPU_REPLICAS', 0))
+        if cpu_replicas > 0 and detector.device == 'cpu':
+            batch_fns = start_cpu_pool(detector, cpu_replicas, weights_cache or default_weights_cache(detector))
+        else:
+            if weights_cache and not os.path.exists(weights_cache):
+                # Cold start: write the float weights so the next restart skips the HF load path
+                detector.model = detector.load_model(quantize=False)
+                detector.export_weights(weights_cache)
+                if detector.precision == 'int8':
+                    detector.model = detector.quantize_model(detector.model)
+            else:
+                detector.initialize_model()
+            # MODEL_WORKERS > 1 loads extra replicas, each served by its own worker thread
+            batch_fns = [detector.detect_batch]
+            for _ in range(int(os.getenv('MODEL_WORKERS', 1)) - 1):
+                batch_fns.append(functools.partial(detector.detect_batch, model=detector.load_model()))
+
+        # Run a blank frame through every worker so the first real request is not slow
+        model_status['state'] = 'warming'
+        detector.warmup(batch_fns)
+
+        # Serialize model calls from concurrent cameras onto the worker pool. Batches run as a
+        # per-image loop, so waiting for one to fill would only add latency.
+        detector.scheduler = InferenceScheduler(
+            batch_fns,
+            max_batch_size=int(os.getenv('BATCH_MAX_SIZE', 8)),
+            max_wait_ms=float(os.getenv('BATCH_MAX_WAIT_MS', 0)),
+        )
+        # Results of evicted camera sessions leave the publisher too, so client-chosen ids stay bounded
+        detector.sessions.add_evict_listener(publisher.forget)
+        threat_detector = detector
+        model_status.update(state='ready', load_seconds=time.time() - start_time)
+        logger.info("Model ready in %.1fs", model_status['load_seconds'])
+    except Exception as e:
+        logger.error("Error loading model: %s", e, exc_info=True)
+        model_status.update(state='error', error=str(e), load_seconds=time.time() - start_time)
+        return
+    start_ingestion(detector)
+
+
+def start_ingestion(detector):
+    """Pull configured RTSP/MJPEG/file sources server-side; bad stream settings only log"""
+    global ingestion
+    try:
+        manager = IngestionManager(
+            detector, publisher.publish,
+            queue_size=int(os.getenv('STREAM_QUEUE_SIZE', 2)),
+            max_sources=int(os.getenv('STREAM_MAX_SOURCES', 16)),
+            allowed_schemes=parse_list(os.getenv('STREAM_ALLOWED_SCHEMES', 'rtsp,rtsps,http,https')),
+            allowed_hosts=parse_list(os.getenv('STREAM_ALLOWED_HOSTS', '')),
+        )
+    except ValueError as e:
+        # The model is up either way; a bad stream setting must not flip /api/health to error
+        logger.error("Stream ingestion is disabled: %s", e)
+        return
+    ingestion = manager
+    try:
+        sources = parse_sources(os.getenv('STREAM_SOURCES', ''))
+    except ValueError as e:
+        logger.error("Ignoring STREAM_SOURCES: %s", e)
+        return
+    # Operator-configured sources are trusted and may be local files or devices
+    for source_id, uri in sources.items():
+        try:
+            ingestion.add(source_id, uri, loop=os.getenv('STREAM_LOOP_FILES') == '1')
+        except (ValueError, RuntimeError) as e:
+            logger.error("Not starting stream %s: %s", source_id, e)
+
+
+def start_cpu_pool(detector, num_replicas, weights_path):
+    """Run inference in pinned CPU replica processes that share memory-mapped weights"""
+    global cpu_pool
+    if not os.path.exists(weights_path):
+        # One HF load in this process to produce the shared weights file, then free it
+        detector.model = detector.load_model(quantize=False)
+        detector.export_weights(weights_path)
+        detector.model = None
+    threads = os.getenv('CPU_THREADS_PER_REPLICA')
+    cpu_pool = CpuReplicaPool(
+        num_replicas,
+        weights_path,
+        threads_per_replica=int(threads) if threads else None,
+        pin_cores=os.getenv('CPU_PIN_CORES', '1') == '1',
+        threat_queries=detector.threat_queries,
+        precision=detector.precision,
+    )
+    # Each scheduler worker feeds one replica, so an idle replica always takes the next batch
+    return cpu_pool.batch_fns()
+
+
+def shutdown_detector():
+    """Stop the inference workers and release model memory"""
+    global threat_detector, cpu_pool, ingestion
+    with _detector_lock:
+        if ingestion is not None:
+            ingestion.stop()
+            ingestion = None
+        if threat_detector is not None:
+            threat_detector.scheduler.stop()
+            del threat_detector.model
+            threat_detector = None
+        model_status.update(state='idle', load_seconds=None, error=None)
+        if cpu_pool is not None:
+            cpu_pool.stop()
+            cpu_pool = None
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def model_memory_bytes():
+    """Bytes held by the loaded model weights (device allocator on CUDA)"""
+    detector = threat_detector
+    if detector is None or detector.model is None:
+        return {}
+    if detector.device == 'cuda':
+        return {(detector.device,): torch.cuda.memory_allocated()}
+    tensors = list(detector.model.parameters()) + list(detector.model.buffers())
+    return {(detector.device,): sum(t.numel() * t.element_size() for t in tensors)}
+
+
+# Stage latency histograms for every frame, labeled by camera
+stages.add_observer(metrics.observe_stage)
+DETECT_ENDPOINTS = ('detect_threats', 'detect_threats_annotated')
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    'safeai_request_seconds', 'HTTP request latency for detection endpoints', ('endpoint',))
+IN_FLIGHT = metrics.REGISTRY.gauge(
+    'safeai_requests_in_flight', 'Detection requests currently being handled', ('endpoint',))
+# Scrape-time gauges read straight from the live components
+metrics.REGISTRY.gauge(
+    'safeai_scheduler_queue_depth', 'Frames waiting for an inference worker',
+    fn=lambda: {(): threat_detector.scheduler.stats()['queue_depth']} if threat_detector is not None else {})
+metrics.REGISTRY.gauge(
+    'safeai_active_sessions', 'Camera sessions with recent frames',
+    fn=lambda: {(): len(threat_detector.sessions)} if threat_detector is not None else {})
+metrics.REGISTRY.gauge(
+    'safeai_result_cache_bytes', 'Approximate size of cached detections',
+    fn=lambda: {(): threat_detector.result_cache.stats()['bytes']} if threat_detector is not None else {})
+metrics.REGISTRY.gauge('safeai_model_memory_bytes', 'Memory used by model weights', ('device',), fn=model_memory_bytes)
+metrics.REGISTRY.gauge(
+    'safeai_cpu_replica_in_flight', 'Frames in flight per CPU replica process', ('replica',),
+    fn=lambda: {(r['replica'],): r['in_flight'] for r in cpu_pool.stats()} if cpu_pool is not None else {})
+metrics.REGISTRY.gauge(
+    'safeai_stream_queue_depth', 'Buffered frames per server-side stream', ('camera',),
+    fn=lambda: {(s['id'],): s['queue_depth'] for s in ingestion.stats()} if ingestion is not None else {})
+metrics.REGISTRY.gauge(
+    'safeai_event_subscribers', 'Open /api/events subscriptions',
+    fn=lambda: {(): publisher.stats()['subscribers']})
+
+
+@app.before_request
+def start_request_metrics():
+    if request.endpoint in DETECT_ENDPOINTS and request.method == 'POST':
+        request.metrics_start = time.perf_counter()
+        IN_FLIGHT.inc(request.endpoint)
+
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    start = getattr(request, 'metrics_start', None)
+    if start is not None:
+        IN_FLIGHT.dec(request.endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, request.endpoint)
+
+
+def parse_flag(value):
+    """JSON booleans plus their common string forms ("false", "0", "no"); None if unrecognized"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}.get(value.strip().lower())
+    if isinstance(value, int):
+        return {1: True, 0: False}.get(value)
+    return None
+
+
+def trace_requested():
+    """Per-request stage spans are returned when asked for with ?trace=1 or X-Trace: 1"""
+    return request.args.get('trace') == '1' or request.headers.get('X-Trace') == '1'
+
+
+# Content types accepted as a raw encoded frame in the request body
+BINARY_IMAGE_TYPES = ('image/jpeg', 'image/png', 'application/octet-stream')
+
+
+def ensure_threat_levels(threats):
+    """Make sure threats have all the necessary fields, and add any missing ones"""
+    for threat in threats:
+        # Ensure threat level is present, defaulting to HIGH if missing
+        if 'level' not in threat:
+            # Try to determine level based on type
+            if threat.get('type', '').lower() in ['weapon', 'knife', 'gun']:
+                threat['level'] = 'HIGH'
+            elif threat.get('type', '').lower() in ['suspicious person', 'hooded', 'hoodie']:
+                threat['level'] = 'MEDIUM'
+            elif threat.get('type', '').lower() in ['pen', 'pencil', 'writing implement']:
+                threat['level'] = 'LOW'
+            else:
+                threat['level'] = 'HIGH'  # Default to high for unknown threats
+    return threats
+
+
+def read_binary_frame():
+    """Return the encoded frame from a raw image body or a multipart 'image' field, or None"""
+    if request.mimetype in BINARY_IMAGE_TYPES:
+        return request.get_data(cache=False)
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        return upload.read() if upload else None
+    return None
+
+
+def model_not_ready():
+    """503 response while the model is still loading"""
+    return jsonify({'error': 'Model is not ready', 'state': model_status['state']}), 503
+
+
+def detect_binary(detector, annotated):
+    """Run detection on a raw or multipart frame upload"""
+    image_bytes = read_binary_frame()
+    if not image_bytes:
+        logger.error("No image data provided in request")
+        return jsonify({'error': 'No image data provided'}), 400
+
+    camera_id = request.args.get('camera_id') or request.form.get('camera_id') or request.headers.get('X-Camera-Id')
+    try:
+        with stages.trace(trace_requested()) as spans:
+            jpeg_bytes, threats = detector.process_image_bytes(image_bytes, camera_id, annotate=annotated)
+    except ValueError as e:
+        logger.error("Invalid image upload: %s", e)
+        return jsonify({'error': str(e)}), 400
+    ensure_threat_levels(threats)
+    if camera_id:
+        publisher.publish(camera_id, threats)
+
+    if annotated:
+        # Binary JPEG body, detections ride along in a header
+        response = Response(jpeg_bytes, mimetype='image/jpeg')
+        response.headers['X-Threats'] = json.dumps(threats, separators=(',', ':'))
+        if trace_requested():
+            response.headers['X-Trace'] = json.dumps(spans, separators=(',', ':'))
+        return response
+
+    response = {
+        'threats': threats,
+        'camera_id': camera_id,
+        'timestamp': time.time()
+    }
+    if trace_requested():
+        response['trace'] = spans
+    return jsonify(response)
 
 
 @app.route('/api/detect', methods=['POST', 'OPTIONS'])
@@ -42,72 +350,207 @@ def detect_threats():
         response = app.make_default_options_response()
         return response
 
+    detector = get_detector()
+    if detector is None:
+        return model_not_ready()
+
     try:
+        # Raw image/jpeg or multipart uploads skip the base64/JSON round trip
+        if not request.is_json:
+            return detect_binary(detector, annotated=False)
+
         # Get image data from request
         data = request.get_json()
-        logger.info("Received POST request with data keys: %s", list(data.keys()) if data else "No data")
-        
         if not data or 'image' not in data:
             logger.error("No image data provided in request")
             return jsonify({'error': 'No image data provided'}), 400
 
-        # Log image data size
         image_data = data['image']
-        logger.info("Received image data of length: %d", len(image_data))
+
+        # Camera id keeps throttling and cached detections separate per stream
+        camera_id = data.get('camera_id') or request.headers.get('X-Camera-Id')
+
+        # Clients that draw boxes themselves can skip the annotated image entirely
+        annotate = parse_flag(data.get('annotate', True))
+        if annotate is None:
+            return jsonify({'error': 'annotate must be a boolean'}), 400
 
         # Process the image using the threat detector
-        logger.info("Starting image processing...")
-        processed_image, threats = threat_detector.process_base64_image(image_data)
-        logger.info("Processing complete. Found %d threats", len(threats))
+        with stages.trace(trace_requested()) as spans:
+            processed_image, threats = detector.process_base64_image(image_data, camera_id, annotate)
         
-        # Make sure threats have all the necessary fields, and add any missing ones
-        for threat in threats:
-            # Ensure threat level is present, defaulting to HIGH if missing
-            if 'level' not in threat:
-                # Try to determine level based on type
-                if threat.get('type', '').lower() in ['weapon', 'knife', 'gun']:
-                    threat['level'] = 'HIGH'
-                elif threat.get('type', '').lower() in ['suspicious person', 'hooded', 'hoodie']:
-                    threat['level'] = 'MEDIUM'
-                elif threat.get('type', '').lower() in ['pen', 'pencil', 'writing implement']:
-                    threat['level'] = 'LOW'
-                else:
-                    threat['level'] = 'HIGH'  # Default to high for unknown threats
+        ensure_threat_levels(threats)
+        if camera_id:
+            # Subscribers to /api/events see uploaded cameras alongside server-side streams
+            publisher.publish(camera_id, threats)
         
         # Prepare response
         response = {
-            'processed_image': processed_image,
             'threats': threats,
+            'camera_id': camera_id,
             'timestamp': time.time()
         }
+        if annotate:
+            response['processed_image'] = processed_image
+        if trace_requested():
+            response['trace'] = spans
         
         return jsonify(response)
 
     except Exception as e:
-        logger.error(f"Error processing request: {e}", exc_info=True)
+        logger.error("Error processing request: %s", e, exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/detect/annotated', methods=['POST', 'OPTIONS'])
+def detect_threats_annotated():
+    """Endpoint returning the annotated frame as image/jpeg with threats in X-Threats"""
+    if request.method == 'OPTIONS':
+        return app.make_default_options_response()
+
+    detector = get_detector()
+    if detector is None:
+        return model_not_ready()
+
+    try:
+        return detect_binary(detector, annotated=True)
+    except Exception as e:
+        logger.error("Error processing request: %s", e, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/streams', methods=['GET', 'POST', 'OPTIONS'])
+def streams():
+    """List server-side video sources, or start one from {"id", "uri", "loop"}"""
+    if request.method == 'OPTIONS':
+        return app.make_default_options_response()
+
+    if get_detector() is None or ingestion is None:
+        return model_not_ready()
+
+    if request.method == 'GET':
+        return jsonify({'streams': ingestion.stats()})
+
+    if not STREAM_ALLOW_RUNTIME:
+        return jsonify({'error': 'Adding streams at runtime is disabled'}), 403
+    data = request.get_json(silent=True) or {}
+    if not data.get('id') or not isinstance(data.get('uri'), str):
+        return jsonify({'error': 'Stream id and uri are required'}), 400
+    try:
+        ingestion.check_uri(data['uri'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 403
+    try:
+        source = ingestion.add(str(data['id']), data['uri'], loop=data.get('loop') is True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify(source.stats()), 201
+
+
+@app.route('/api/streams/<stream_id>', methods=['DELETE', 'OPTIONS'])
+def delete_stream(stream_id):
+    """Stop a server-side video source"""
+    if request.method == 'OPTIONS':
+        return app.make_default_options_response()
+
+    if not STREAM_ALLOW_RUNTIME:
+        return jsonify({'error': 'Removing streams at runtime is disabled'}), 403
+    if ingestion is None or not ingestion.remove(stream_id):
+        return jsonify({'error': f'Unknown stream {stream_id}'}), 404
+    return jsonify({'id': stream_id, 'stopped': True})
+
+
+@app.route('/api/streams/<stream_id>/latest', methods=['GET'])
+def latest_stream_result(stream_id):
+    """Most recent detections for a camera, without uploading a frame"""
+    result = publisher.latest(stream_id)
+    if result is None:
+        return jsonify({'error': f'No results for {stream_id}'}), 404
+    ensure_threat_levels(result['threats'])
+    return jsonify(result)
+
+
+@app.route('/api/events', methods=['GET'])
+def detection_events():
+    """Server-Sent Events stream of per-camera detection changes and threat-level transitions"""
+    cameras = request.args.get('cameras')
+    try:
+        subscription = publisher.subscribe(cameras.split(',') if cameras else None)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
+
+    def stream():
+        try:
+            yield 'retry: 2000\n\n'
+            while not subscription.closed:
+                events = subscription.get(timeout=EVENTS_KEEPALIVE)
+                if not events:
+                    # Keeps proxies from timing out the connection and surfaces dead clients
+                    yield ': keepalive\n\n'
+                    continue
+                for event in events:
+                    if event['event'] == 'detections':
+                        ensure_threat_levels(event['threats'])
+                    yield f"event: {event['event']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+        finally:
+            publisher.unsubscribe(subscription)
+
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    # Frees the slot even if the client disconnects before the stream is first iterated
+    response.call_on_close(lambda: publisher.unsubscribe(subscription))
+    return response
+
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of pipeline histograms, counters and gauges"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
    """Health check endpoint"""
+   detector = threat_detector
+   if detector is None:
+       return jsonify({
+           'status': model_status['state'],
+           'state': model_status['state'],
+           'model_loaded': False,
+           'load_seconds': model_status['load_seconds'],
+           'error': model_status['error'],
+           'timestamp': time.time()
+       })
    return jsonify({
        'status': 'healthy',
-       'model_loaded': threat_detector.model is not None,
-       'device': threat_detector.device,
+       'state': model_status['state'],
+       'load_seconds': model_status['load_seconds'],
+       'model_loaded': detector.model is not None or cpu_pool is not None,
+       'device': detector.device,
+       'precision': detector.precision,
+       'cpu_replicas': cpu_pool.stats() if cpu_pool is not None else [],
+       'active_sessions': len(detector.sessions),
+       'scheduler': detector.scheduler.stats(),
+       'result_cache': detector.result_cache.stats(),
+       'streams': ingestion.stats() if ingestion is not None else [],
+       'events': publisher.stats(),
        'timestamp': time.time()
    })
 
 
 if __name__ == '__main__':
+   # Development server; use serve.py for production
    port = int(os.getenv('PORT', 8000))
+   start_detector()
    try:
-       app.run(host='0.0.0.0', port=port, debug=True)
+       # The reloader would import this module twice and load a second model copy
+       app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_DEBUG') == '1', use_reloader=False, threaded=True)
    finally:
        # Cleanup resources
-       if hasattr(threat_detector, 'model'):
-           del threat_detector.model
-       if torch.cuda.is_available():
-           torch.cuda.empty_cache()
+       shutdown_detector()
 
 
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from detectweapons import ThreatDetectionSystem
+from result_cache import DetectionCache
+from scheduler import InferenceScheduler
+from sessions import SessionRegistry
+from stages import StageRecorder
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Throttle / motion gate / result cache settings per benchmark mode
+MODES = {
+   # Every frame reaches the model
+   'cold': {'throttle': False, 'motion': False, 'cache': False},
+   # Fingerprint cache on, so repeated corpus frames skip the model
+   'cached': {'throttle': False, 'motion': False, 'cache': True},
+   # Motion gate on, as for a live camera without the rate limit
+   'gated': {'throttle': False, 'motion': True, 'cache': True},
+   # Production defaults: rate limit, motion gate and cache
+   'throttled': {'throttle': True, 'motion': True, 'cache': True},
+}
+
+APIS = ('base64', 'frame', 'bytes')
+
+
+class StubModel:
+   """Stand-in for Moondream with fixed encode/detect costs; needs no weights or download.
+
+   Returns one box per weapon query so the tracking, caching and drawing stages
+   do real work.
+   """
+
+   def __init__(self, encode_ms: float = 40.0, detect_ms: float = 15.0):
+       self.encode_seconds = encode_ms / 1000.0
+       self.detect_seconds = detect_ms / 1000.0
+
+   def encode_image(self, image):
+       time.sleep(self.encode_seconds)
+       return image
+
+   def detect(self, encoded_image, query):
+       time.sleep(self.detect_seconds)
+       if 'weapon' not in query:
+           return {'objects': []}
+       return {'objects': [{'x_min': 0.4, 'y_min': 0.3, 'x_max': 0.55, 'y_max': 0.6}]}
+
+
+def load_corpus(image_dir: Optional[str], count: int, width: int, height: int) -> List[np.ndarray]:
+   """Frames from a directory in sorted order, or a deterministic synthetic clip"""
+   if image_dir:
+       names = sorted(n for n in os.listdir(image_dir) if n.lower().endswith(IMAGE_EXTENSIONS))
+       if not names:
+           raise SystemExit(f"No images found in {image_dir}")
+       return [cv2.imread(os.path.join(image_dir, n)) for n in names]
+   rng = np.random.default_rng(0)
+   background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+   background = cv2.GaussianBlur(background, (31, 31), 0)
+   frames = []
+   for i in range(count):
+       frame = background.copy()
+       # An object crossing the scene, so motion gating and ROI planning see change
+       x = int((i / max(1, count - 1)) * (width - width // 8))
+       cv2.rectangle(frame, (x, height // 3), (x + width // 8, height // 3 + height // 4), (40, 40, 200), -1)
+       frames.append(frame)
+   return frames
+
+
+def build_detector(args) -> ThreatDetectionSystem:
+   if args.model == 'stub':
+       detector = ThreatDetectionSystem(initialize=False, precision='fp32')
+       detector.model = StubModel(args.stub_encode_ms, args.stub_detect_ms)
+   else:
+       detector = ThreatDetectionSystem(precision=args.precision)
+   detector.warmup()
+   return detector
+
+
+def apply_mode(detector: ThreatDetectionSystem, mode: str, defaults: Dict) -> None:
+   """Reset per-camera state and switch the throttle, motion gate and cache for one run"""
+   settings = MODES[mode]
+   detector.sessions = SessionRegistry()
+   detector.min_process_interval = defaults['min_process_interval'] if settings['throttle'] else 0.0
+   # A zero threshold makes every frame count as scene change
+   detector.motion_threshold = defaults['motion_threshold'] if settings['motion'] else 0.0
+   detector.result_cache = DetectionCache(ttl=defaults['cache_timeout'] if settings['cache'] else 0.0)
+
+
+def percentiles(samples: List[float]) -> Dict:
+   values = np.asarray(samples) * 1000.0
+   return {
+       'count': len(samples),
+       'mean_ms': float(values.mean()),
+       'p50_ms': float(np.percentile(values, 50)),
+       'p95_ms': float(np.percentile(values, 95)),
+       'p99_ms': float(np.percentile(values, 99)),
+   }
+
+
+def run_benchmark(detector: ThreatDetectionSystem, frames: List[np.ndarray], api: str,
+                  concurrency: int, passes: int, batch_max_size: int = 8, batch_max_wait_ms: float = 0.0) -> Dict:
+   """Feed the corpus through one entry point from `concurrency` cameras at once"""
+   encoded = [cv2.imencode('.jpg', frame)[1].tobytes() for frame in frames]
+   payloads = {
+       'base64': [base64.b64encode(data).decode('utf-8') for data in encoded],
+       'bytes': encoded,
+       'frame': frames,
+   }[api]
+   calls = {
+       'base64': lambda payload, camera: detector.process_base64_image(payload, camera),
+       'bytes': lambda payload, camera: detector.process_image_bytes(payload, camera, annotate=True),
+       'frame': lambda payload, camera: detector.process_frame(payload, camera),
+   }[api]
+
+   latencies: List[float] = []
+   latencies_lock = threading.Lock()
+
+   def camera_worker(index: int) -> None:
+       camera_id = f"bench-{index}"
+       local = []
+       for _ in range(passes):
+           for payload in payloads:
+               start = time.perf_counter()
+               calls(payload, camera_id)
+               local.append(time.perf_counter() - start)
+       with latencies_lock:
+           latencies.extend(local)
+
+   # Concurrent cameras share the model through the inference scheduler, configured as in the server
+   detector.scheduler = InferenceScheduler(
+       detector.detect_batch, max_batch_size=batch_max_size, max_wait_ms=batch_max_wait_ms,
+   ) if concurrency > 1 else None
+   with StageRecorder() as recorder:
+       start_time = time.perf_counter()
+       workers = [threading.Thread(target=camera_worker, args=(i,)) for i in range(concurrency)]
+       for worker in workers:
+           worker.start()
+       for worker in workers:
+           worker.join()
+       elapsed = time.perf_counter() - start_time
+   scheduler_stats = detector.scheduler.stats() if detector.scheduler is not None else None
+   if detector.scheduler is not None:
+       detector.scheduler.stop()
+       detector.scheduler = None
+
+   return {
+       'latency': percentiles(latencies),
+       'fps': len(latencies) / elapsed if elapsed else 0.0,
+       'seconds': elapsed,
+       'stages': {name: percentiles(samples) for name, samples in sorted(recorder.samples.items())},
+       'result_cache': detector.result_cache.stats(),
+       'scheduler': scheduler_stats,
+   }
+
+
+def print_report(results: List[Dict]) -> None:
+   for result in results:
+       latency = result['latency']
+       print(f"\n{result['api']:>6} {result['mode']:<9} x{result['concurrency']:<3}"
+             f" {result['fps']:8.1f} fps   p50 {latency['p50_ms']:8.2f} ms"
+             f"   p95 {latency['p95_ms']:8.2f} ms   p99 {latency['p99_ms']:8.2f} ms")
+       for name, timing in result['stages'].items():
+           print(f"    {name:<32} n={timing['count']:<6} mean {timing['mean_ms']:8.2f} ms"
+                 f"   p95 {timing['p95_ms']:8.2f} ms")
+
+
+def main(argv: List[str] = None) -> int:
+   parser = argparse.ArgumentParser(description="Latency and throughput benchmark for the detection pipeline")
+   parser.add_argument('--images', help="Directory with a fixed frame corpus (default: synthetic clip)")
+   parser.add_argument('--frames', type=int, default=60, help="Synthetic clip length")
+   parser.add_argument('--size', default='1280x720', help="Synthetic frame size, WIDTHxHEIGHT")
+   parser.add_argument('--passes', type=int, default=1, help="Times each camera replays the corpus")
+   parser.add_argument('--api', default='base64,frame', help=f"Comma list of {', '.join(APIS)}")
+   parser.add_argument('--modes', default='cold,cached', help=f"Comma list of {', '.join(MODES)}")
+   parser.add_argument('--concurrency', default='1,4', help="Comma list of concurrent camera counts")
+   parser.add_argument('--model', choices=['stub', 'real'], default='stub')
+   parser.add_argument('--precision', default=None, help="Precision for --model real")
+   parser.add_argument('--stub-encode-ms', type=float, default=40.0)
+   parser.add_argument('--stub-detect-ms', type=float, default=15.0)
+   # Same defaults as the server's scheduler (BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS)
+   parser.add_argument('--batch-max-size', type=int, default=int(os.getenv('BATCH_MAX_SIZE', 8)))
+   parser.add_argument('--batch-max-wait-ms', type=float, default=float(os.getenv('BATCH_MAX_WAIT_MS', 0)))
+   parser.add_argument('--output', help="Write the full report as JSON")
+   args = parser.parse_args(argv)
+
+   # Per-frame detection logs would dominate the timings
+   logging.getLogger('detectweapons').setLevel(logging.WARNING)
+
+   width, height = (int(v) for v in args.size.lower().split('x'))
+   frames = load_corpus(args.images, args.frames, width, height)
+   detector = build_detector(args)
+   defaults = {
+       'min_process_interval': detector.min_process_interval,
+       'motion_threshold': detector.motion_threshold,
+       'cache_timeout': detector.cache_timeout,
+   }
+
+   results = []
+   for api in args.api.split(','):
+       if api not in APIS:
+           raise SystemExit(f"Unknown api {api}")
+       for mode in args.modes.split(','):
+           if mode not in MODES:
+               raise SystemExit(f"Unknown mode {mode}")
+           for concurrency in (int(c) for c in args.concurrency.split(',')):
+               apply_mode(detector, mode, defaults)
+               result = run_benchmark(detector, frames, api, concurrency, args.passes,
+                                      args.batch_max_size, args.batch_max_wait_ms)
+               result.update(api=api, mode=mode, concurrency=concurrency)
+               results.append(result)
+
+   print_report(results)
+   if args.output:
+       with open(args.output, 'w') as f:
+           json.dump({
+               'model': args.model,
+               'device': detector.device,
+               'precision': detector.precision,
+               'frames': len(frames),
+               'results': results,
+           }, f, indent=2)
+   return 0
+
+
+if __name__ == '__main__':
+   sys.exit(main())
@@ -0,0 +1,148 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# Threat levels from least to most severe; cross-query merges keep the more severe class
+THREAT_LEVELS = ('NORMAL', 'LOW', 'MEDIUM', 'HIGH')
+LEVEL_RANK = {level: rank for rank, level in enumerate(THREAT_LEVELS)}
+
+
+def box_iou(a: Sequence[float], b: Sequence[float]) -> float:
+   """Intersection over union of two [x_min, y_min, x_max, y_max] boxes"""
+   inter_w = min(a[2], b[2]) - max(a[0], b[0])
+   inter_h = min(a[3], b[3]) - max(a[1], b[1])
+   if inter_w <= 0 or inter_h <= 0:
+       return 0.0
+   inter = inter_w * inter_h
+   union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+   return inter / union if union > 0 else 0.0
+
+
+def match_threats(reference: List[Dict], candidate: List[Dict], iou_threshold: float = 0.5) -> List[Tuple[int, int, float]]:
+   """Greedily pair threats of the same type by descending IoU; returns (ref_idx, cand_idx, iou)"""
+   pairs = []
+   for i, ref in enumerate(reference):
+       for j, cand in enumerate(candidate):
+           if ref["type"] == cand["type"]:
+               iou = box_iou(ref["bbox"], cand["bbox"])
+               if iou >= iou_threshold:
+                   pairs.append((iou, i, j))
+   pairs.sort(reverse=True)
+   used_ref, used_cand, matches = set(), set(), []
+   for iou, i, j in pairs:
+       if i not in used_ref and j not in used_cand:
+           used_ref.add(i)
+           used_cand.add(j)
+           matches.append((i, j, iou))
+   return matches
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+   """Pairwise IoU of (N, 4) and (M, 4) box arrays as an (N, M) matrix"""
+   top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+   bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+   inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+   area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+   area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+   union = area_a[:, None] + area_b[None, :] - inter
+   return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def greedy_suppress(boxes: np.ndarray, order: np.ndarray, iou_threshold: float,
+                    groups: Optional[np.ndarray] = None, across_groups: bool = False) -> np.ndarray:
+   """Indices kept by greedy NMS visiting boxes in ``order``.
+
+   With ``groups``, only boxes in the same group suppress each other, or only
+   boxes in different groups when ``across_groups`` is set.
+   """
+   overlaps = iou_matrix(boxes, boxes) >= iou_threshold
+   if groups is not None:
+       same = groups[:, None] == groups[None, :]
+       overlaps &= ~same if across_groups else same
+   suppressed = np.zeros(len(boxes), dtype=bool)
+   keep = []
+   for index in order:
+       if not suppressed[index]:
+           keep.append(index)
+           suppressed |= overlaps[index]
+   return np.asarray(keep, dtype=np.intp)
+
+
+class Detections:
+   """Detections as parallel arrays: (N, 4) boxes, (N,) scores and (N,) threat query indices.
+
+   Pipeline stages scale, merge and cache these arrays directly; ``to_threats``
+   builds the per-threat dicts once, where results leave the detector.
+   """
+
+   __slots__ = ("boxes", "scores", "classes")
+
+   def __init__(self, boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray):
+       self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+       self.scores = np.asarray(scores, dtype=np.float64)
+       self.classes = np.asarray(classes, dtype=np.int16)
+
+   @classmethod
+   def empty(cls) -> "Detections":
+       return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0))
+
+   @classmethod
+   def concat(cls, parts: Sequence["Detections"]) -> "Detections":
+       if not parts:
+           return cls.empty()
+       return cls(np.concatenate([p.boxes for p in parts]),
+                  np.concatenate([p.scores for p in parts]),
+                  np.concatenate([p.classes for p in parts]))
+
+   def __len__(self) -> int:
+       return len(self.scores)
+
+   @property
+   def nbytes(self) -> int:
+       return self.boxes.nbytes + self.scores.nbytes + self.classes.nbytes
+
+   def select(self, index: np.ndarray) -> "Detections":
+       return Detections(self.boxes[index], self.scores[index], self.classes[index])
+
+   def transform(self, scale_x: float, scale_y: float, offset_x: float = 0.0, offset_y: float = 0.0) -> "Detections":
+       """Boxes mapped by ``box * scale + offset`` in one vectorized step"""
+       scale = np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float64)
+       offset = np.array([offset_x, offset_y, offset_x, offset_y], dtype=np.float64)
+       return Detections(self.boxes * scale + offset, self.scores, self.classes)
+
+   def nms(self, iou_threshold: float) -> "Detections":
+       """Class-aware NMS: overlapping boxes from the same query keep only the highest score"""
+       if len(self) < 2:
+           return self
+       order = np.argsort(-self.scores, kind='stable')
+       keep = greedy_suppress(self.boxes, order, iou_threshold, self.classes)
+       return self.select(np.sort(keep))
+
+   def merge_queries(self, levels: np.ndarray, iou_threshold: float) -> "Detections":
+       """Collapse overlapping boxes from different queries onto the most severe level.
+
+       ``levels`` maps query index to level rank. Boxes are visited by level rank
+       and then score, so a knife reported as both weapon and sharp tool stays a
+       single HIGH detection. Boxes from the same query never suppress each other
+       here, so two adjacent weapons stay two detections.
+       """
+       if len(self) < 2:
+           return self
+       order = np.lexsort((-self.scores, -levels[self.classes]))
+       keep = greedy_suppress(self.boxes, order, iou_threshold, self.classes, across_groups=True)
+       return self.select(np.sort(keep))
+
+   def count_by_class(self, num_classes: int) -> np.ndarray:
+       return np.bincount(self.classes, minlength=num_classes)
+
+   def to_threats(self, queries: Sequence[Dict], timestamp: Optional[float] = None) -> List[Dict]:
+       """Per-threat dicts in the API format"""
+       threats = []
+       for bbox, score, cls in zip(self.boxes.tolist(), self.scores.tolist(), self.classes.tolist()):
+           query = queries[cls]
+           threat = {"bbox": bbox, "confidence": score, "type": query["type"], "level": query["level"]}
+           if timestamp is not None:
+               threat["timestamp"] = timestamp
+           threats.append(threat)
+       return threats
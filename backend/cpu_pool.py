@@ -0,0 +1,211 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+from boxes import Detections
+
+
+logger = logging.getLogger(__name__)
+
+
+def available_cores() -> List[int]:
+   """Cores this process may run on"""
+   if hasattr(os, "sched_getaffinity"):
+       return sorted(os.sched_getaffinity(0))
+   return list(range(os.cpu_count() or 1))
+
+
+def _replica_main(index: int, cores: Sequence[int], num_threads: int, weights_path: str,
+                  threat_queries: Optional[List[Dict]], precision: Optional[str], conn) -> None:
+   """Replica process: pin to its cores, load memory-mapped weights, serve detect batches"""
+   # Pin before torch spins up its thread pool so every intra-op thread inherits the mask
+   if cores and hasattr(os, "sched_setaffinity"):
+       os.sched_setaffinity(0, cores)
+   import torch
+   torch.set_num_threads(num_threads)
+   torch.set_num_interop_threads(1)
+
+   from detectweapons import ThreatDetectionSystem
+   detector = ThreatDetectionSystem(threat_queries=threat_queries, weights_path=weights_path, precision=precision)
+   logger.info(f"CPU replica {index} ready on cores {list(cores)} with {num_threads} threads")
+   conn.send(("ready", None))
+
+   while True:
+       try:
+           frames = conn.recv()
+       except EOFError:
+           break
+       if frames is None:
+           break
+       try:
+           images = [Image.fromarray(frame) for frame in frames]
+           conn.send(("ok", detector.detect_batch(images)))
+       except Exception as e:
+           conn.send(("error", str(e)))
+
+
+class CpuReplica:
+   """Parent-side handle for one replica process, respawned if the process dies"""
+
+   def __init__(self, ctx, index: int, cores: Sequence[int], num_threads: int,
+                weights_path: str, threat_queries: Optional[List[Dict]], precision: Optional[str],
+                start_timeout: float = 600.0):
+       self.index = index
+       self.cores = list(cores)
+       self.num_threads = num_threads
+       self.start_timeout = start_timeout
+       self.in_flight = 0
+       self.completed = 0
+       self.restarts = 0
+       self._ctx = ctx
+       self._args = (weights_path, threat_queries, precision)
+       self._lock = threading.Lock()
+       self._count_lock = threading.Lock()
+       self._spawn()
+
+   def _spawn(self) -> None:
+       self._conn, child_conn = self._ctx.Pipe()
+       self.process = self._ctx.Process(
+           target=_replica_main,
+           args=(self.index, self.cores, self.num_threads) + self._args + (child_conn,),
+           name=f"cpu-replica-{self.index}",
+           daemon=True,
+       )
+       self.process.start()
+       child_conn.close()
+
+   def wait_ready(self, timeout: Optional[float] = None) -> None:
+       if not self._conn.poll(timeout):
+           raise TimeoutError(f"CPU replica {self.index} did not start in time")
+       try:
+           status, _ = self._conn.recv()
+       except EOFError:
+           status = "exited"
+       if status != "ready":
+           raise RuntimeError(f"CPU replica {self.index} failed to start")
+
+   def _respawn(self) -> None:
+       """Replace a dead replica process; called with the request lock held"""
+       logger.error("CPU replica %d (pid %s) died with exit code %s, restarting",
+                    self.index, self.process.pid, self.process.exitcode)
+       self._conn.close()
+       if self.process.is_alive():
+           self.process.terminate()
+       self.process.join(timeout=5)
+       self.restarts += 1
+       self._spawn()
+       self.wait_ready(self.start_timeout)
+
+   def _roundtrip(self, frames: List[np.ndarray]):
+       if not self.process.is_alive():
+           self._respawn()
+       self._conn.send(frames)
+       return self._conn.recv()
+
+   def detect_batch(self, images: List[Image.Image]) -> List[Detections]:
+       """Send a batch to the replica process and wait for its detections.
+
+       If the process died, it is restarted and the batch retried once, so a
+       crash costs this worker a restart instead of failing every later batch.
+       """
+       self._track(len(images))
+       try:
+           frames = [np.asarray(image) for image in images]
+           # One outstanding batch per replica keeps request/response pairs in order
+           with self._lock:
+               try:
+                   status, payload = self._roundtrip(frames)
+               except (EOFError, OSError):
+                   self._respawn()
+                   try:
+                       status, payload = self._roundtrip(frames)
+                   except (EOFError, OSError):
+                       # Restarted lazily on the next batch
+                       raise RuntimeError(f"CPU replica {self.index} died twice on the same batch")
+           if status != "ok":
+               raise RuntimeError(f"CPU replica {self.index}: {payload}")
+           with self._count_lock:
+               self.completed += len(images)
+           return payload
+       finally:
+           self._track(-len(images))
+
+   def _track(self, delta: int) -> None:
+       with self._count_lock:
+           self.in_flight += delta
+
+   def stop(self) -> None:
+       try:
+           self._conn.send(None)
+       except (BrokenPipeError, OSError):
+           pass
+       self.process.join(timeout=5)
+       if self.process.is_alive():
+           self.process.terminate()
+
+
+class CpuReplicaPool:
+   """K model replicas in separate processes, each pinned to its own slice of cores.
+
+   Replicas load the same pre-serialized state dict with mmap, so the weights are
+   shared through the page cache instead of costing K times the RSS.
+   """
+
+   def __init__(self, num_replicas: int, weights_path: str,
+                threads_per_replica: Optional[int] = None, pin_cores: bool = True,
+                threat_queries: Optional[List[Dict]] = None, precision: Optional[str] = None,
+                start_timeout: float = 600.0):
+       cores = available_cores()
+       num_replicas = max(1, min(num_replicas, len(cores)))
+       if threads_per_replica is None:
+           threads_per_replica = max(1, len(cores) // num_replicas)
+       elif pin_cores and threads_per_replica * num_replicas > len(cores):
+           # Later replicas would get an empty core slice and run unpinned
+           clamped = max(1, len(cores) // num_replicas)
+           logger.warning("%d replicas x %d threads exceeds %d cores, using %d threads per replica",
+                          num_replicas, threads_per_replica, len(cores), clamped)
+           threads_per_replica = clamped
+       ctx = multiprocessing.get_context("spawn")
+       start_time = time.time()
+       self.replicas = []
+       for index in range(num_replicas):
+           replica_cores = cores[index * threads_per_replica:(index + 1) * threads_per_replica] if pin_cores else []
+           self.replicas.append(CpuReplica(ctx, index, replica_cores, threads_per_replica, weights_path,
+                                           threat_queries, precision, start_timeout))
+       for replica in self.replicas:
+           replica.wait_ready(start_timeout)
+       logger.info(f"Started {num_replicas} CPU replicas in {time.time() - start_time:.1f}s")
+
+   def batch_fns(self) -> List:
+       """One batch function per replica, for InferenceScheduler workers to pull from a shared queue"""
+       return [replica.detect_batch for replica in self.replicas]
+
+   def detect_batch(self, images: List[Image.Image]) -> List[Detections]:
+       """Dispatch a batch to the least-loaded replica"""
+       replica = min(self.replicas, key=lambda r: r.in_flight)
+       return replica.detect_batch(images)
+
+   def stats(self) -> List[Dict]:
+       return [
+           {
+               'replica': r.index,
+               'pid': r.process.pid,
+               'alive': r.process.is_alive(),
+               'restarts': r.restarts,
+               'cores': r.cores,
+               'threads': r.num_threads,
+               'in_flight': r.in_flight,
+               'completed': r.completed,
+           }
+           for r in self.replicas
+       ]
+
+   def stop(self) -> None:
+       for replica in self.replicas:
+           replica.stop()
@@ -2,22 +2,25 @@ import os
 import time
 import uuid
 from PIL import Image
-import io
 import logging
 from datetime import datetime
 import base64
 from dotenv import load_dotenv
-from transformers import AutoModelForCausalLM
 import torch
 import numpy as np
 import cv2
-import matplotlib.pyplot as plt
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 from contextlib import contextmanager
+from sessions import CameraSession, SessionRegistry
+from result_cache import DetectionCache
+from boxes import Detections, LEVEL_RANK
+from stages import stage, camera as stage_camera
+from structured_logging import configure_logging
+import metrics
+import roi
 
 
-# Force full precision mode and enable HF transfer
-os.environ["COMMANDLINE_ARGS"] = '--precision full --no-half'
+# Enable HF transfer
 os.environ["HF_HUB_ENABLE_HF_TRANSFER"] = "1"
 
 
@@ -26,22 +29,66 @@ load_dotenv()
 
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 #IMPORTANT: UNINSTALL TORCH AND INSTALL TORCH FOR CUDA 11.8 IF U HAVE A GPU
 
+
+# Threat categories queried against every processed frame. Each entry reuses the
+# same image encoding, so adding a category only costs one extra detect query.
+DEFAULT_THREAT_QUERIES = [
+   {"query": "knife or gun or lethal weapon", "level": "HIGH", "type": "weapon"},
+   {"query": "scissors or sharp tools", "level": "MEDIUM", "type": "suspicious person"},
+   {"query": "pen, pencil, or water bottle", "level": "LOW", "type": "writing implement"}
+]
+
+
+MODEL_ID = "vikhyatk/moondream2"
+MODEL_REVISION = "2025-01-09"
+
+
+# Selectable precision modes and the dtype the weights run in. int8 keeps fp32
+# activations and dynamically quantizes the nn.Linear layers the model calls as
+# modules (CPU only); see quantize_model.
+PRECISION_MODES = {
+   "fp32": torch.float32,
+   "bf16": torch.bfloat16,
+   "fp16": torch.float16,
+   "int8": torch.float32,
+}
+
+
+def cpu_supports_bf16() -> bool:
+   """Whether oneDNN has native bf16 kernels on this CPU (AVX512-BF16/AMX)"""
+   try:
+       return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+   except Exception:
+       return False
+
+
 class ThreatDetectionSystem:
-   def __init__(self):
+   def __init__(self, threat_queries: Optional[List[Dict]] = None,
+                weights_path: Optional[str] = None, initialize: bool = True,
+                precision: Optional[str] = None):
        self.model = None
+       self.threat_queries = list(threat_queries or DEFAULT_THREAT_QUERIES)
+       # Level rank per query, for merging boxes that several queries report
+       self.query_levels = np.array([LEVEL_RANK.get(q["level"], LEVEL_RANK["HIGH"]) for q in self.threat_queries])
+       # Same-query boxes overlapping past NMS_IOU are suppressed; boxes from different
+       # queries overlapping past MERGE_IOU keep the most severe level (0 disables the merge)
+       self.nms_iou = float(os.getenv('NMS_IOU', 0.5))
+       self.merge_iou = float(os.getenv('MERGE_IOU', 0.5))
+       # Pre-serialized state dict that is memory-mapped instead of copied into each process
+       self.weights_path = weights_path
        # Check for Apple Silicon (MPS), CUDA, or fallback to CPU
        if torch.backends.mps.is_available():
            self.device = "mps"
            logger.info("Using Apple Silicon (MPS) device")
            # Conservative settings for MPS
            self.min_process_interval = 1.5
-           self.cache_timeout = 2.0
-           self.process_every_n_frames = 4
+           self.cache_timeout = 10.0
+           self.max_staleness = 10.0
            self.detection_timeout = 3.0
        elif torch.cuda.is_available():
            self.device = "cuda"
@@ -50,8 +97,8 @@ class ThreatDetectionSystem:
            torch.cuda.set_device(0)
            # Aggressive settings for CUDA
            self.min_process_interval = 0.1
-           self.cache_timeout = 0.5
-           self.process_every_n_frames = 1
+           self.cache_timeout = 5.0
+           self.max_staleness = 2.0
            self.detection_timeout = 1.0
        else:
            self.device = "cpu"
@@ -61,70 +108,208 @@ class ThreatDetectionSystem:
            torch.set_default_device('cpu')
            # Conservative settings for CPU
            self.min_process_interval = 1.5
-           self.cache_timeout = 2.0
-           self.process_every_n_frames = 4
+           self.cache_timeout = 10.0
+           self.max_staleness = 10.0
            self.detection_timeout = 3.0
-       self.last_process_time = 0
+       # PRECISION selects fp32 (default), bf16, fp16 or int8; unsupported modes fall back to fp32
+       self.precision = self._resolve_precision(precision or os.getenv('PRECISION', 'fp32'))
+       self.dtype = PRECISION_MODES[self.precision]
        self.max_image_size = 256
-       self.result_cache = {}
-       self.frame_counter = 0
-       self.last_detections = []
-       self.initialize_model()
+       # ROI crops go through the encoder at Moondream's native 378px crop size
+       self.roi_size = 378
+       self.roi_max_windows = int(os.getenv('ROI_MAX_WINDOWS', 2))
+       # Fraction of thumbnail pixels that must change before the model runs again;
+       # max_staleness forces a refresh of static scenes
+       self.motion_threshold = float(os.getenv('MOTION_THRESHOLD', 0.003))
+       self.max_staleness = float(os.getenv('MAX_STALENESS', self.max_staleness))
+       # Throttle counters and last detections are tracked per camera
+       self.sessions = SessionRegistry(on_evict=metrics.forget_camera)
+       # Bounded cache keyed on a frame fingerprint so static scenes skip the model
+       self.result_cache = DetectionCache(
+           ttl=self.cache_timeout,
+           max_bytes=int(float(os.getenv('RESULT_CACHE_MAX_MB', 8)) * 1024 * 1024),
+           max_diff=int(os.getenv('RESULT_CACHE_MAX_DIFF', 12)),
+       )
+       # Optional InferenceScheduler that batches model calls across cameras
+       self.scheduler = None
+       # Callers that dispatch inference elsewhere (e.g. a CPU replica pool) skip the local model
+       if initialize:
+           self.initialize_model()
+
+
+   def _resolve_precision(self, precision: str) -> str:
+       """Validate a precision mode, falling back to fp32 when the device cannot run it"""
+       precision = precision.lower()
+       if precision not in PRECISION_MODES:
+           raise ValueError(f"Unknown precision mode '{precision}', expected one of {list(PRECISION_MODES)}")
+       if precision == "bf16":
+           if self.device == "cuda":
+               supported = torch.cuda.is_bf16_supported()
+           else:
+               supported = self.device == "cpu" and cpu_supports_bf16()
+       elif precision == "fp16":
+           supported = self.device in ("cuda", "mps")
+       elif precision == "int8":
+           supported = self.device == "cpu"
+       else:
+           supported = True
+       if not supported:
+           logger.warning(f"Precision {precision} is not supported on {self.device}, using fp32")
+           return "fp32"
+       return precision
 
 
    def initialize_model(self) -> None:
        """Initialize the Moondream 2 model with error handling."""
+       self.model = self.load_model()
+
+
+   def load_model(self, quantize: bool = True):
+       """Load a Moondream 2 instance for this device; also used to build extra worker replicas."""
+       model = self._load_weights()
+       if quantize and self.precision == "int8":
+           model = self.quantize_model(model)
+       return model
+
+
+   def quantize_model(self, model):
+       """Dynamically quantize to int8 the nn.Linear layers that the model calls as ``module(x)``.
+
+       Moondream's layers mostly call ``F.linear(x, w.weight, w.bias)`` on Linear
+       modules. A quantized Linear's ``weight`` is a method, so that call would
+       fail. A blank calibration frame records which layers actually go through
+       ``forward``, and only those are converted. If there are none, the model
+       stays float and the precision falls back to fp32.
+       """
+       called = set()
+       hooks = [
+           module.register_forward_hook(lambda *_, name=name: called.add(name))
+           for name, module in model.named_modules() if isinstance(module, torch.nn.Linear)
+       ]
+       try:
+           self.detect_batch([Image.new('RGB', (self.max_image_size, self.max_image_size))], model=model)
+       finally:
+           for hook in hooks:
+               hook.remove()
+       if not called:
+           logger.warning("No linear layers are called as modules, nothing to quantize; using fp32")
+           self.precision = "fp32"
+           return model
+       qconfig = torch.ao.quantization.default_dynamic_qconfig
+       model = torch.ao.quantization.quantize_dynamic(model, {name: qconfig for name in called}, dtype=torch.qint8)
+       logger.info("Applied dynamic int8 quantization to %d of %d linear layers", len(called), len(hooks))
+       return model
+
+
+   def _load_weights(self):
+       """Load float weights from the memory-mapped cache when present, otherwise from Hugging Face"""
+       if self.weights_path and os.path.exists(self.weights_path):
+           try:
+               return self.load_mmap_model(self.weights_path)
+           except Exception as e:
+               logger.warning(f"Could not load memory-mapped weights from {self.weights_path}: {e}")
+       # transformers is only needed on the HF load path, so import it lazily
+       from transformers import AutoModelForCausalLM
+
        try:
            logger.info("Initializing Moondream 2 model...")
-           model_id = "vikhyatk/moondream2"
-           revision = "2025-01-09"
+           model_id = MODEL_ID
+           revision = MODEL_REVISION
 
            if self.device == "mps":
                device_map = {"": self.device}
-               self.model = AutoModelForCausalLM.from_pretrained(
+               model = AutoModelForCausalLM.from_pretrained(
                    model_id,
                    revision=revision,
                    trust_remote_code=True,
                    low_cpu_mem_usage=True,
                    device_map=device_map,
-                   torch_dtype=torch.float32,  # Changed from bfloat16 to float32
+                   torch_dtype=self.dtype,
                )
            elif self.device == "cuda":
                device_map = {"": self.device}
-               self.model = AutoModelForCausalLM.from_pretrained(
+               model = AutoModelForCausalLM.from_pretrained(
                    model_id,
                    revision=revision,
                    trust_remote_code=True,
                    low_cpu_mem_usage=True,
                    device_map=device_map,
-                   torch_dtype=torch.float32,  # Force FP32 for consistency
+                   torch_dtype=self.dtype,
                )
                # Ensure model is on CUDA
-               self.model = self.model.cuda()
+               model = model.cuda()
                logger.info("Model moved to CUDA successfully")
            else:
                device_map = None
-               # Force PyTorch to use float32
+               # Keep float32 as the default dtype for tensors created outside the model
                torch.set_default_dtype(torch.float32)
                
-               self.model = AutoModelForCausalLM.from_pretrained(
+               model = AutoModelForCausalLM.from_pretrained(
                    model_id,
                    revision=revision,
                    trust_remote_code=True,
-                   torch_dtype=torch.float32,
+                   torch_dtype=self.dtype,
                    device_map={"": "cpu"}
                )
-               logger.info("Model initialized in FP32 mode for Windows CPU")
+               logger.info(f"Model initialized in {self.precision} mode for CPU")
 
            # Ensure model is in eval mode
-           self.model.eval()
+           model.eval()
            logger.info("✓ Model initialized successfully")
+           return model
        except Exception as e:
            logger.error(f"Error initializing model: {e}")
            raise
 
 
-   def fig2rgb_array(self, fig: plt.Figure) -> np.ndarray:
+   def load_mmap_model(self, weights_path: str):
+       """Build the model skeleton without weights and attach a memory-mapped state dict.
+
+       Tensors stay backed by the mapped file, so every process that loads the same
+       file shares one copy of the weights through the OS page cache.
+       """
+       from accelerate import init_empty_weights
+       from transformers import AutoConfig, AutoModelForCausalLM
+
+       logger.info(f"Loading memory-mapped weights from {weights_path}")
+       config = AutoConfig.from_pretrained(MODEL_ID, revision=MODEL_REVISION, trust_remote_code=True)
+       with init_empty_weights():
+           model = AutoModelForCausalLM.from_config(config, trust_remote_code=True, torch_dtype=torch.float32)
+       state_dict = torch.load(weights_path, map_location="cpu", mmap=True, weights_only=True)
+       model.load_state_dict(state_dict, strict=False, assign=True)
+       # No-op when the file was exported in this precision, so the mapping stays shared
+       # Anything not covered by the state dict would still be an empty meta tensor
+       missing = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+       if missing:
+           raise RuntimeError(f"{len(missing)} tensors missing from weights file, e.g. {missing[0]}")
+       model = model.to(self.dtype)
+       if self.device != "cpu":
+           model = model.to(self.device)
+       model.eval()
+       logger.info("✓ Model initialized from memory-mapped weights")
+       return model
+
+
+   def export_weights(self, weights_path: str) -> None:
+       """Serialize the loaded model's state dict for memory-mapped loading"""
+       if any(name.endswith("_packed_params") for name in self.model.state_dict()):
+           raise RuntimeError("Quantized models cannot be exported; export the float weights instead")
+       tmp_path = f"{weights_path}.tmp"
+       os.makedirs(os.path.dirname(os.path.abspath(weights_path)), exist_ok=True)
+       torch.save(self.model.state_dict(), tmp_path)
+       # Rename last so concurrent readers never see a partial file
+       os.replace(tmp_path, weights_path)
+       logger.info(f"Exported model weights to {weights_path}")
+
+
+   def warmup(self, batch_fns: Optional[List[Callable]] = None) -> None:
+       """Run a blank frame through each model so the first real request skips lazy initialization"""
+       image = Image.new('RGB', (self.max_image_size, self.max_image_size))
+       for batch_fn in batch_fns or [self.detect_batch]:
+           batch_fn([image])
+
+
+   def fig2rgb_array(self, fig: "matplotlib.figure.Figure") -> np.ndarray:
        """Convert matplotlib figure to RGB array"""
        fig.canvas.draw()
        buf = fig.canvas.buffer_rgba()
@@ -136,6 +321,9 @@ class ThreatDetectionSystem:
 
    def visualize_frame(self, frame: np.ndarray, threats: List[Dict]) -> np.ndarray:
        """Visualize a single frame with detected threats"""
+       # matplotlib is slow to import and only needed for this debug visualization
+       import matplotlib.pyplot as plt
+
        try:
            # Create figure without margins
            fig = plt.figure(figsize=(frame.shape[1] / 100, frame.shape[0] / 100), dpi=100)
@@ -185,174 +373,278 @@ class ThreatDetectionSystem:
            return frame
 
 
-   def resize_image(self, image: Image.Image) -> Image.Image:
-       """Resize image while maintaining aspect ratio"""
-       width, height = image.size
-       if width > self.max_image_size or height > self.max_image_size:
-           ratio = min(self.max_image_size / width, self.max_image_size / height)
+   def prepare_image(self, frame: np.ndarray, max_size: Optional[int] = None) -> Image.Image:
+       """Downscale a BGR frame with OpenCV and convert it to an RGB PIL image"""
+       max_size = max_size or self.max_image_size
+       height, width = frame.shape[:2]
+       if width > max_size or height > max_size:
+           ratio = min(max_size / width, max_size / height)
            new_size = (int(width * ratio), int(height * ratio))
-           return image.resize(new_size, Image.Resampling.BILINEAR)  # Changed to BILINEAR for speed
+           with stage('resize'):
+               frame = cv2.resize(frame, new_size, interpolation=cv2.INTER_LINEAR)
+       with stage('color_convert'):
+           if frame.ndim == 2:
+               return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB))
+           return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+   def encode_image(self, image: Image.Image, model=None):
+       """Encode an image once so it can be reused by every detect query"""
+       model = model if model is not None else self.model
+       # Older model revisions have no encode_image; detect() will encode the raw image
+       if hasattr(model, "encode_image"):
+           return model.encode_image(image)
        return image
 
 
-   def process_frame(self, frame: np.ndarray) -> Tuple[np.ndarray, List[Dict]]:
+   def run_detections(self, images: List[Image.Image]) -> List[Detections]:
+       """Detect threats in several images; with a scheduler they join the same micro-batch"""
+       if self.scheduler is not None:
+           # Queue wait plus model time, attributed to the requesting camera
+           with stage('inference'):
+               futures = [self.scheduler.submit(image) for image in images]
+               return [future.result() for future in futures]
+       return self.detect_batch(images)
+
+
+   def detect_batch(self, images: List[Image.Image], model=None) -> List[Detections]:
+       """Run every threat query over a batch of resized images.
+
+       Each image is encoded once, then the queries are run back to back over the
+       encodings. The model takes one image per call, so this is a loop and costs
+       the same as running the images one by one. Boxes are returned
+       normalized to the image they were detected in, with the query index as
+       their class. ``model`` selects a worker replica; it defaults to the primary model.
+       """
+       model = model if model is not None else self.model
+       parts = [[] for _ in images]
+       with torch.no_grad():
+           # Run the vision encoder once per image and share it across every query
+           encoded_images = []
+           for image in images:
+               with stage('encode'):
+                   encoded_images.append(self.encode_image(image, model))
+
+           # Run detection for each threat type
+           for class_index, threat_type in enumerate(self.threat_queries):
+               for encoded_image, image_parts in zip(encoded_images, parts):
+                   with stage(f"detect:{threat_type['type']}"):
+                       detection_result = model.detect(
+                           encoded_image,
+                           threat_type["query"]
+                       )
+
+                   if isinstance(detection_result, dict) and "objects" in detection_result:
+                       detections = detection_result["objects"]
+                   elif isinstance(detection_result, list):
+                       detections = detection_result
+                   else:
+                       logger.warning("Unexpected detection result format: %s", type(detection_result))
+                       detections = []
+
+                   logger.debug("Found %d %s detections", len(detections), threat_type['type'])
+                   image_parts.append(self._parse_objects(detections, class_index))
+       return [Detections.concat(image_parts) for image_parts in parts]
+
+
+   def _parse_objects(self, objects: List[Dict], class_index: int) -> Detections:
+       """Model output objects for one query as a Detections block; malformed objects are skipped"""
+       rows = []
+       for obj in objects:
+           try:
+               rows.append([float(obj.get("x_min", 0)), float(obj.get("y_min", 0)),
+                            float(obj.get("x_max", 1)), float(obj.get("y_max", 1)),
+                            float(obj.get("confidence", 1.0))])
+           except (AttributeError, TypeError, ValueError) as e:
+               logger.warning("Skipping malformed detection object %r: %s", obj, e)
+       values = np.array(rows, dtype=np.float64).reshape(-1, 5)
+       return Detections(values[:, :4], values[:, 4], np.full(len(values), class_index))
+
+
+   def postprocess(self, detections: Detections) -> Detections:
+       """Class-aware NMS, then collapse boxes several queries reported onto the most severe one"""
+       with stage('postprocess'):
+           detections = detections.nms(self.nms_iou)
+           if self.merge_iou > 0:
+               detections = detections.merge_queries(self.query_levels, self.merge_iou)
+       return detections
+
+
+   def process_frame(self, frame: np.ndarray, session_id: Optional[str] = None) -> Tuple[np.ndarray, List[Dict]]:
        """Process a single frame and return the processed frame with threat detections."""
-       try:
-           # Convert frame to PIL Image
-           image = Image.fromarray(frame)
-           logger.info(f"Processing image of size: {image.size}, mode: {image.mode}")
-           
-           # Resize image if needed
-           image = self.resize_image(image)
-           
-           # Convert to RGB if needed
-           if image.mode != 'RGB':
-               image = image.convert('RGB')
-           
-           # Convert to tensor and ensure correct dtype
-           image_tensor = torch.from_numpy(np.array(image)).float()
-           image_tensor = image_tensor.permute(2, 0, 1).unsqueeze(0)
-           image_tensor = image_tensor / 255.0  # Normalize to [0, 1]
-           
-           # Move tensor to the correct device
-           image_tensor = image_tensor.to(self.device)
-           
-           # Ensure tensor is in FP32 for Windows CPU
-           if self.device == "cpu":
-               image_tensor = image_tensor.float()
-           
-           logger.info(f"Input tensor shape: {image_tensor.shape}, device: {image_tensor.device}, dtype: {image_tensor.dtype}")
+       threats, _ = self.detect_frame(frame, session_id)
+       with stage('draw'):
+           return self.draw_threats(frame, threats), threats
+
+
+   def detect_frame(self, frame: np.ndarray, session_id: Optional[str] = None,
+                    annotate: bool = False) -> Tuple[List[Dict], Optional[bytes]]:
+       """Detect threats in a frame and, if requested, return the annotated frame as JPEG bytes.
+
+       The annotated JPEG is cached per session and only re-rendered when the
+       session's detections change, so throttled frames reuse the last render.
+       """
+       return self._detect(lambda: frame, session_id, annotate)
+
 
+   def _detect(self, load_frame: Callable[[], np.ndarray], session_id: Optional[str],
+               annotate: bool) -> Tuple[List[Dict], Optional[bytes]]:
+       """Throttle first, then decode only if the frame is processed or needs a fresh render."""
+       session = self.sessions.get(session_id)
+       with session.lock, stage_camera(session.session_id), stage('frame'):
            current_time = time.time()
-           
-           # Frame skipping logic
-           self.frame_counter += 1
-           if self.frame_counter % self.process_every_n_frames != 0:
-               return self.draw_threats(frame, self.last_detections), self.last_detections
+           frame = None
+           if self._should_skip(session, current_time):
+               metrics.FRAMES.inc(session.session_id, 'throttled')
+               threats = self._propagate_tracks(session, current_time)
+           else:
+               frame = load_frame()
+               if self._scene_changed(frame, session, current_time):
+                   # Counted as cached or processed once the result cache has been checked
+                   threats = self._process_session_frame(frame, session, current_time)
+               else:
+                   metrics.FRAMES.inc(session.session_id, 'static')
+                   threats = self._propagate_tracks(session, current_time)
+           if not annotate:
+               return threats, None
+           if session.annotated_jpeg is None or session.annotated_version != session.detections_version:
+               if frame is None:
+                   frame = load_frame()
+               with stage('draw'):
+                   drawn = self.draw_threats(frame, threats)
+               with stage('jpeg_encode'):
+                   _, buffer = cv2.imencode('.jpg', drawn)
+               session.annotated_jpeg = buffer.tobytes()
+               session.annotated_version = session.detections_version
+           return threats, session.annotated_jpeg
+
+
+   def _propagate_tracks(self, session: CameraSession, current_time: float) -> List[Dict]:
+       """Move tracked boxes along their velocity on frames the model does not see"""
+       threats = session.tracker.predict(current_time)
+       self._update_detections(session, threats)
+       return threats
+
+
+   def _should_skip(self, session: CameraSession, current_time: float) -> bool:
+       """Rate limit on model calls, evaluated before any decode or resize work"""
+       return current_time - session.last_process_time < self.min_process_interval
+
+
+   def _scene_changed(self, frame: np.ndarray, session: CameraSession, current_time: float) -> bool:
+       """Motion gate: run the model on enough scene change or once detections get too stale"""
+       with stage('motion'):
+           session.last_motion_score = session.motion.update(frame)
+       if session.last_motion_score >= self.motion_threshold:
+           return True
+       return current_time - session.last_process_time >= self.max_staleness
+
+
+   def _update_detections(self, session: CameraSession, threats: List[Dict]) -> None:
+       """Store a session's new detections, bumping its version only if the boxes changed"""
+       signature = tuple(
+           (t['type'], t.get('level'), tuple(round(v) for v in t['bbox'])) for t in threats
+       )
+       if signature != session.detections_signature:
+           session.detections_signature = signature
+           session.detections_version += 1
+       session.last_detections = threats
+
+
+   def plan_windows(self, frame: np.ndarray, session: CameraSession) -> List[List[int]]:
+       """Pick ROI crop windows from motion blobs and previous detections; [] means whole frame"""
+       # Staleness refreshes and first frames always look at the whole scene
+       if self.roi_max_windows <= 0 or session.last_motion_score < self.motion_threshold:
+           return []
+       frame_height, frame_width = frame.shape[:2]
+       # A frame this small already reaches the encoder at close to native resolution
+       if max(frame_width, frame_height) <= self.roi_size * 1.5:
+           return []
+       regions = roi.motion_regions(session.motion.last_mask, frame_width, frame_height)
+       regions.extend(threat['bbox'] for threat in session.last_detections)
+       windows = roi.plan_windows(regions, frame_width, frame_height, self.roi_size, self.roi_max_windows)
+       # Past half the frame, one downscaled full-frame pass is cheaper than the crops
+       covered = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in windows)
+       if not windows or covered > 0.5 * frame_width * frame_height:
+           return []
+       return windows
+
+
+   def detect_windows(self, frame: np.ndarray, windows: List[List[int]]) -> Detections:
+       """Detect threats in each crop window (batched) and return post-processed boxes normalized to the frame"""
+       frame_height, frame_width = frame.shape[:2]
+       if windows:
+           max_size = self.roi_size
+       else:
+           windows, max_size = [[0, 0, frame_width, frame_height]], self.max_image_size
+       images = [self.prepare_image(frame[y0:y1, x0:x1], max_size) for x0, y0, x1, y1 in windows]
+       # Crop-normalized -> frame-normalized in one affine step per window
+       parts = [
+           detections.transform((x1 - x0) / frame_width, (y1 - y0) / frame_height, x0 / frame_width, y0 / frame_height)
+           for (x0, y0, x1, y1), detections in zip(windows, self.run_detections(images))
+       ]
+       return self.postprocess(Detections.concat(parts))
+
+
+   def _scale_threats(self, detections: Detections, frame_width: int, frame_height: int, current_time: float) -> List[Dict]:
+       """Scale frame-normalized detections to pixel coordinates and build the threat dicts"""
+       return detections.transform(frame_width, frame_height).to_threats(self.threat_queries, current_time)
+
 
-           if current_time - self.last_process_time < self.min_process_interval:
-               return self.draw_threats(frame, self.last_detections), self.last_detections
+   def _process_session_frame(self, frame: np.ndarray, session: CameraSession, current_time: float) -> List[Dict]:
+       """Run caching and detection for a frame that passed the session throttle."""
+       try:
+           frame_height, frame_width = frame.shape[:2]
 
-           # Create a hash of the image for caching using numpy array
-           image_array = image_tensor.cpu().numpy()
-           image_hash = hash(image_array.tobytes())
+           # Fingerprint the frame so near-identical scenes reuse earlier detections
+           with stage('fingerprint'):
+               fingerprint = self.result_cache.fingerprint(frame)
            
-           # Check cache
-           if image_hash in self.result_cache:
-               cache_entry = self.result_cache[image_hash]
-               if current_time - cache_entry['timestamp'] < self.cache_timeout:
-                   scale_x = frame.shape[1] / image.size[0]
-                   scale_y = frame.shape[0] / image.size[1]
-                   threats = []
-                   for threat in cache_entry['threats']:
-                       scaled_threat = {
-                           'bbox': [
-                               threat['bbox'][0] * scale_x,
-                               threat['bbox'][1] * scale_y,
-                               threat['bbox'][2] * scale_x,
-                               threat['bbox'][3] * scale_y
-                           ],
-                           'confidence': threat['confidence'],
-                           'type': threat['type'],
-                           'timestamp': current_time
-                       }
-                       threats.append(scaled_threat)
-                   self.last_detections = threats
-                   return self.draw_threats(frame, threats), threats
-
-           self.last_process_time = current_time
-
-           # Use the model to detect weapons
-           with torch.no_grad():
-               try:
-                   logger.info(f"Processing image of size: {image.size}, mode: {image.mode}")
-                   
-                   # Define the three threat types we want to detect
-                   threat_types = [
-                       {"query": "knife or gun or lethal weapon", "level": "HIGH", "type": "weapon"},
-                       {"query": "scissors or sharp tools", "level": "MEDIUM", "type": "suspicious person"},
-                       {"query": "pen, pencil, or water bottle", "level": "LOW", "type": "writing implement"}
-                   ]
-                   
-                   all_threats = []
-                   
-                   # Run detection for each threat type
-                   for threat_type in threat_types:
-                       # Use the model's built-in detect method directly for all devices
-                       detection_result = self.model.detect(
-                           image, 
-                           threat_type["query"]
-                       )
-                       logger.info(f"Detection result for {threat_type['type']}: {type(detection_result)}")
-                       
-                       if isinstance(detection_result, dict) and "objects" in detection_result:
-                           detections = detection_result["objects"]
-                       elif isinstance(detection_result, list):
-                           detections = detection_result
-                       else:
-                           logger.warning(f"Unexpected detection result format: {type(detection_result)}")
-                           detections = []
-
-                       # Log number of detections
-                       logger.info(f"Found {len(detections)} {threat_type['type']} detections")
-
-                       # Convert normalized coordinates to pixel values and build threat objects
-                       img_width, img_height = image.size
-                       for obj in detections:
-                           try:
-                               x_min = float(obj.get("x_min", 0)) * img_width
-                               y_min = float(obj.get("y_min", 0)) * img_height
-                               x_max = float(obj.get("x_max", 1)) * img_width
-                               y_max = float(obj.get("y_max", 1)) * img_height
-                               threat = {
-                                   "bbox": [x_min, y_min, x_max, y_max],
-                                   "confidence": float(obj.get("confidence", 1.0)),
-                                   "type": threat_type["type"],
-                                   "level": threat_type["level"],
-                                   "timestamp": current_time
-                               }
-                               all_threats.append(threat)
-                               logger.info(f"Processed threat: {threat}")
-                           except Exception as e:
-                               logger.error(f"Error processing detection object: {e}")
-                               continue
-                   
-                   # Cache the results
-                   self.result_cache[image_hash] = {
-                       'threats': all_threats,
-                       'timestamp': current_time
-                   }
-
-                   # Scale threats back to original size
-                   scale_x = frame.shape[1] / image.size[0]
-                   scale_y = frame.shape[0] / image.size[1]
-                   scaled_threats = []
-                   for threat in all_threats:
-                       scaled_threat = {
-                           'bbox': [
-                               threat['bbox'][0] * scale_x,
-                               threat['bbox'][1] * scale_y,
-                               threat['bbox'][2] * scale_x,
-                               threat['bbox'][3] * scale_y
-                           ],
-                           'confidence': threat['confidence'],
-                           'type': threat['type'],
-                           'level': threat['level'],
-                           'timestamp': current_time
-                       }
-                       scaled_threats.append(scaled_threat)
-
-                   # Update last detections
-                   self.last_detections = scaled_threats
-                   return self.draw_threats(frame, scaled_threats), scaled_threats
+           # A staleness refresh must reach the model, or cached boxes would outlive max_staleness
+           stale = current_time - session.last_process_time >= self.max_staleness
+           cached_threats = None if stale else self.result_cache.get(session.session_id, fingerprint, current_time)
+           if cached_threats is not None:
+               metrics.CACHE_LOOKUPS.inc(session.session_id, 'hit')
+               metrics.FRAMES.inc(session.session_id, 'cached')
+               threats = self._scale_threats(cached_threats, frame_width, frame_height, current_time)
+               threats = session.tracker.update(threats, current_time)
+               self._update_detections(session, threats)
+               return threats
+
+           if not stale:
+               metrics.CACHE_LOOKUPS.inc(session.session_id, 'miss')
+           metrics.FRAMES.inc(session.session_id, 'processed')
+           session.last_process_time = current_time
 
-               except Exception as e:
-                   logger.error(f"Error during model inference: {e}")
-                   return self.draw_threats(frame, self.last_detections), self.last_detections
+           try:
+               # Look at motion / tracked regions at native resolution, or at the whole frame
+               windows = self.plan_windows(frame, session)
+               normalized_threats = self.detect_windows(frame, windows)
+               for query, count in zip(self.threat_queries, normalized_threats.count_by_class(len(self.threat_queries))):
+                   if count:
+                       metrics.DETECTIONS.inc(session.session_id, query['level'], amount=int(count))
+
+               # Cache the results in frame-normalized coordinates
+               self.result_cache.put(session.session_id, fingerprint, normalized_threats, current_time)
+
+               # Scale threats back to original size
+               scaled_threats = self._scale_threats(normalized_threats, frame_width, frame_height, current_time)
+
+               # Confirm or refresh tracks, then update last detections
+               tracked_threats = session.tracker.update(scaled_threats, current_time)
+               self._update_detections(session, tracked_threats)
+               # Sampled per camera by the logging filter, so this stays cheap at any frame rate
+               logger.info("Model run on %dx%d frame found %d threats", frame_width, frame_height,
+                           len(tracked_threats), extra={'windows': len(windows)})
+               return tracked_threats
+
+           except Exception as e:
+               logger.error("Error during model inference: %s", e)
+               return session.last_detections
 
        except Exception as e:
-           logger.error(f"Error processing frame: {e}")
-           return self.draw_threats(frame, self.last_detections), self.last_detections
+           logger.error("Error processing frame: %s", e)
+           return session.last_detections
 
    def draw_threats(self, frame: np.ndarray, threats: List[Dict]) -> np.ndarray:
        """Draw threats on frame using OpenCV"""
@@ -403,34 +695,55 @@ class ThreatDetectionSystem:
                cv2.putText(processed_frame, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
                
            except Exception as e:
-               logger.error(f"Error drawing threat: {e}")
+               logger.error("Error drawing threat: %s", e)
                continue
        
        return processed_frame
 
 
-   def process_base64_image(self, image_data: str) -> Tuple[str, List[Dict]]:
+   def process_base64_image(self, image_data: str, session_id: Optional[str] = None,
+                            annotate: bool = True) -> Tuple[Optional[str], List[Dict]]:
        """Process a base64 encoded image and return processed image and threats"""
-       try:
+       def load_frame() -> np.ndarray:
            # Handle both data URL and raw base64 formats
-           if ',' in image_data:
-               # Data URL format: data:image/jpeg;base64,/9j/4AAQ...
-               image_bytes = base64.b64decode(image_data.split(',')[1])
-           else:
-               # Raw base64 format
-               image_bytes = base64.b64decode(image_data)
-           
-           image = Image.open(io.BytesIO(image_bytes))
-           frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-          
-           # Process the frame to detect threats
-           processed_frame, threats = self.process_frame(frame)
+           with stage('base64_decode'):
+               if ',' in image_data:
+                   # Data URL format: data:image/jpeg;base64,/9j/4AAQ...
+                   image_bytes = base64.b64decode(image_data.split(',')[1])
+               else:
+                   # Raw base64 format
+                   image_bytes = base64.b64decode(image_data)
+           return self.decode_image_bytes(image_bytes)
+
+       try:
+           # Decoding is deferred until the throttle decides the frame is needed
+           threats, jpeg_bytes = self._detect(load_frame, session_id, annotate)
           
-           # Encode the processed frame back to base64
-           _, buffer = cv2.imencode('.jpg', processed_frame)
-           processed_image = base64.b64encode(buffer).decode('utf-8')
+           # Encode the annotated frame to base64 only when it was requested
+           with stage('base64_encode'):
+               processed_image = base64.b64encode(jpeg_bytes).decode('utf-8') if jpeg_bytes else None
            return processed_image, threats
 
        except Exception as e:
-           logger.error(f"Error processing base64 image: {e}")
-           return image_data, []
\ No newline at end of file
+           logger.error("Error processing base64 image: %s", e)
+           return (image_data if annotate else None), []
+
+
+   def decode_image_bytes(self, image_bytes) -> np.ndarray:
+       """Decode JPEG/PNG bytes straight into a BGR frame without intermediate copies"""
+       buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+       with stage('image_decode'):
+           frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+       if frame is None:
+           raise ValueError("Could not decode image data")
+       return frame
+
+
+   def process_image_bytes(self, image_bytes, session_id: Optional[str] = None,
+                           annotate: bool = False) -> Tuple[Optional[bytes], List[Dict]]:
+       """Process a raw encoded image and return (annotated JPEG or None, threats)"""
+       # Throttled frames return without ever decoding the JPEG
+       threats, jpeg_bytes = self._detect(
+           lambda: self.decode_image_bytes(image_bytes), session_id, annotate
+       )
+       return jpeg_bytes, threats
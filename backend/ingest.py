@@ -0,0 +1,278 @@
+import time
+import fnmatch
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import unquote, urlsplit
+
+import cv2
+
+
+logger = logging.getLogger(__name__)
+
+
+class FrameQueue:
+   """Bounded frame buffer whose reader always takes the newest frame.
+
+   ``put`` drops the oldest frame when full and ``get`` discards everything
+   older than the frame it returns, so the worker never falls behind the
+   camera by more than the frame it is processing.
+   """
+
+   def __init__(self, maxsize: int = 2):
+       self._frames = deque(maxlen=maxsize)
+       self._cond = threading.Condition()
+       self.dropped = 0
+
+   def put(self, item) -> None:
+       with self._cond:
+           if len(self._frames) == self._frames.maxlen:
+               self.dropped += 1
+           self._frames.append(item)
+           self._cond.notify()
+
+   def get(self, timeout: Optional[float] = None):
+       """Newest buffered frame, or None on timeout"""
+       with self._cond:
+           if not self._frames:
+               self._cond.wait(timeout)
+           if not self._frames:
+               return None
+           item = self._frames.pop()
+           self.dropped += len(self._frames)
+           self._frames.clear()
+           return item
+
+   def __len__(self) -> int:
+       return len(self._frames)
+
+
+def source_kind(uri: str) -> str:
+   """Classify a source as 'device' (camera index), 'file' (path or file://) or 'stream'"""
+   if uri.strip().isdigit():
+       return 'device'
+   scheme = urlsplit(uri).scheme.lower()
+   # One-letter schemes are Windows drive letters, e.g. C:\videos\hall.mp4
+   if scheme in ('', 'file') or len(scheme) == 1:
+       return 'file'
+   return 'stream'
+
+
+def capture_target(uri: str):
+   """Argument for cv2.VideoCapture: a device index, a local path or the URL itself"""
+   kind = source_kind(uri)
+   if kind == 'device':
+       return int(uri)
+   if kind == 'file' and urlsplit(uri).scheme.lower() == 'file':
+       return unquote(urlsplit(uri).path)
+   return uri
+
+
+class VideoSource:
+   """Reads one video source with OpenCV on its own thread and feeds ThreatDetectionSystem.
+
+   ``uri`` is a local file (plain path or file://), a camera device index, an
+   RTSP URL or an MJPEG/HTTP stream. Files are paced at their native frame rate
+   so they behave like a live camera (and can loop) and finish when they end or
+   cannot be opened; devices and live streams reconnect with backoff.
+   """
+
+   def __init__(self, source_id: str, uri: str, detector, publish: Callable[[str, List[Dict]], None],
+                loop: bool = False, queue_size: int = 2, reconnect_delay: float = 2.0,
+                on_finish: Optional[Callable[["VideoSource"], None]] = None):
+       self.source_id = source_id
+       self.uri = uri
+       self.detector = detector
+       self.publish = publish
+       # Called once a file source has played out and its last frame was processed
+       self.on_finish = on_finish
+       self.loop = loop
+       self.kind = source_kind(uri)
+       self.reconnect_delay = reconnect_delay
+       self.queue = FrameQueue(queue_size)
+       self.frames_read = 0
+       self.frames_processed = 0
+       self.connected = False
+       self.finished = False
+       self.last_error = None
+       self._running = True
+       self._reader = threading.Thread(target=self._read_loop, name=f"ingest-read-{source_id}", daemon=True)
+       self._worker = threading.Thread(target=self._process_loop, name=f"ingest-detect-{source_id}", daemon=True)
+       self._reader.start()
+       self._worker.start()
+
+   @property
+   def is_file(self) -> bool:
+       return self.kind == 'file'
+
+   def _read_loop(self) -> None:
+       delay = self.reconnect_delay
+       while self._running:
+           capture = cv2.VideoCapture(capture_target(self.uri))
+           if not capture.isOpened():
+               self.last_error = f"Could not open {self.uri}"
+               if self.is_file:
+                   # A missing or unreadable file will not appear by retrying
+                   logger.error("Stream %s: %s", self.source_id, self.last_error)
+                   self.finished = True
+                   break
+               logger.warning("Stream %s: %s, retrying in %.0fs", self.source_id, self.last_error, delay)
+               time.sleep(delay)
+               delay = min(delay * 2, 30.0)
+               continue
+           self.connected = True
+           delay = self.reconnect_delay
+           # Pace files at their recorded rate; live sources block on the network instead
+           frame_interval = 0.0
+           if self.is_file:
+               fps = capture.get(cv2.CAP_PROP_FPS)
+               frame_interval = 1.0 / fps if fps and fps > 0 else 1.0 / 30
+           next_frame_time = time.monotonic()
+           while self._running:
+               ok, frame = capture.read()
+               if not ok:
+                   break
+               self.frames_read += 1
+               self.queue.put((time.time(), frame))
+               if frame_interval:
+                   next_frame_time += frame_interval
+                   sleep_for = next_frame_time - time.monotonic()
+                   if sleep_for > 0:
+                       time.sleep(sleep_for)
+           capture.release()
+           self.connected = False
+           if self.is_file and not self.loop:
+               self.finished = True
+               break
+           if self._running and not self.is_file:
+               self.last_error = "Stream ended"
+               logger.warning("Stream %s ended, reconnecting", self.source_id)
+               time.sleep(delay)
+
+   def _process_loop(self) -> None:
+       while self._running:
+           item = self.queue.get(timeout=0.5)
+           if item is None:
+               if self.finished:
+                   if self.on_finish is not None:
+                       self.on_finish(self)
+                   break
+               continue
+           _, frame = item
+           try:
+               threats, _ = self.detector.detect_frame(frame, self.source_id)
+               self.frames_processed += 1
+               self.publish(self.source_id, threats)
+           except Exception as e:
+               self.last_error = str(e)
+               logger.error("Error processing frame from stream %s: %s", self.source_id, e)
+
+   def stop(self) -> None:
+       self._running = False
+       self._reader.join(timeout=5)
+       self._worker.join(timeout=5)
+
+   def stats(self) -> Dict:
+       return {
+           'id': self.source_id,
+           'uri': self.uri,
+           'kind': self.kind,
+           'connected': self.connected,
+           'finished': self.finished,
+           'frames_read': self.frames_read,
+           'frames_processed': self.frames_processed,
+           'frames_dropped': self.queue.dropped,
+           'queue_depth': len(self.queue),
+           'last_error': self.last_error,
+       }
+
+
+class IngestionManager:
+   """Registry of server-side video sources; results go to the publish callback.
+
+   At most ``max_sources`` sources run at once, each costing a reader and a
+   detection thread. ``check_uri`` is the gate for sources requested by
+   clients: only network streams whose scheme and host match the allowlists
+   pass, so a client cannot make the server read local files or fetch
+   arbitrary URLs.
+   """
+
+   def __init__(self, detector, publish: Callable[[str, List[Dict]], None], queue_size: int = 2,
+                max_sources: int = 16, allowed_schemes: Iterable[str] = ('rtsp', 'rtsps', 'http', 'https'),
+                allowed_hosts: Iterable[str] = ()):
+       self.detector = detector
+       self.publish = publish
+       self.queue_size = queue_size
+       self.max_sources = max_sources
+       self.allowed_schemes = {scheme.lower() for scheme in allowed_schemes}
+       # Host names or fnmatch patterns (e.g. 10.0.4.* or *.cams.local); empty allows no host
+       self.allowed_hosts = [host.lower() for host in allowed_hosts]
+       self._sources: Dict[str, VideoSource] = {}
+       self._lock = threading.Lock()
+
+   def check_uri(self, uri: str) -> None:
+       """Raise ValueError unless ``uri`` is a network stream on an allowed scheme and host"""
+       if source_kind(uri) != 'stream':
+           raise ValueError("Only network stream sources can be added at runtime")
+       parts = urlsplit(uri)
+       if parts.scheme.lower() not in self.allowed_schemes:
+           raise ValueError(f"Stream scheme '{parts.scheme}' is not allowed")
+       host = (parts.hostname or '').lower()
+       if not host or not any(fnmatch.fnmatchcase(host, pattern) for pattern in self.allowed_hosts):
+           raise ValueError(f"Stream host '{host}' is not allowed")
+
+   def add(self, source_id: str, uri: str, loop: bool = False) -> VideoSource:
+       """Start a source; ValueError if the id exists, RuntimeError at ``max_sources``"""
+       with self._lock:
+           if source_id in self._sources:
+               raise ValueError(f"Stream {source_id} already exists")
+           if len(self._sources) >= self.max_sources:
+               raise RuntimeError(f"At most {self.max_sources} streams can run at once")
+           source = VideoSource(source_id, uri, self.detector, self.publish, loop=loop, queue_size=self.queue_size,
+                                on_finish=self._finished)
+           self._sources[source_id] = source
+       logger.info("Started stream %s from %s", source_id, uri)
+       return source
+
+   def _finished(self, source: VideoSource) -> None:
+       """Drop a played-out file source so it no longer counts against ``max_sources``"""
+       with self._lock:
+           if self._sources.get(source.source_id) is source:
+               del self._sources[source.source_id]
+       logger.info("Stream %s finished after %d frames", source.source_id, source.frames_read)
+
+   def remove(self, source_id: str) -> bool:
+       with self._lock:
+           source = self._sources.pop(source_id, None)
+       if source is None:
+           return False
+       source.stop()
+       return True
+
+   def stats(self) -> List[Dict]:
+       with self._lock:
+           return [source.stats() for source in self._sources.values()]
+
+   def stop(self) -> None:
+       with self._lock:
+           sources = list(self._sources.values())
+           self._sources.clear()
+       for source in sources:
+           source.stop()
+
+
+def parse_list(spec: str) -> List[str]:
+   """Split a comma-separated setting into its non-empty, stripped entries"""
+   return [part.strip() for part in spec.split(',') if part.strip()]
+
+
+def parse_sources(spec: str) -> Dict[str, str]:
+   """Parse STREAM_SOURCES ("cam1=rtsp://host/a,cam2=/videos/hall.mp4") into {id: uri}"""
+   sources = {}
+   for entry in filter(None, (part.strip() for part in spec.split(','))):
+       source_id, _, uri = entry.partition('=')
+       if not uri:
+           raise ValueError(f"Invalid stream source '{entry}', expected id=uri")
+       sources[source_id.strip()] = uri.strip()
+   return sources
@@ -0,0 +1,209 @@
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from stages import current_camera
+
+
+# Latency buckets in seconds, from sub-millisecond image ops to multi-second CPU inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INF_BUCKET = 'le="+Inf"'
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+   pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+   if extra:
+       pairs.append(extra)
+   return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+   return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+   if math.isinf(value):
+       return '+Inf' if value > 0 else '-Inf'
+   value = float(value)
+   return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Metric:
+   """One metric family with a fixed label set, rendered in the Prometheus text format"""
+
+   type_name = 'untyped'
+
+   def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+       self.name = name
+       self.help_text = help_text
+       self.label_names = tuple(label_names)
+       self._values: Dict[Tuple[str, ...], object] = {}
+       self._lock = threading.Lock()
+
+   def _key(self, labels: Sequence) -> Tuple[str, ...]:
+       if len(labels) != len(self.label_names):
+           raise ValueError(f"{self.name} expects labels {self.label_names}")
+       return tuple(str(label) for label in labels)
+
+   def remove(self, label_name: str, value: str) -> None:
+       """Drop every series whose label matches, e.g. all samples for an evicted camera"""
+       index = self.label_names.index(label_name)
+       with self._lock:
+           for key in [key for key in self._values if key[index] == value]:
+               del self._values[key]
+
+   def samples(self) -> List[str]:
+       raise NotImplementedError
+
+   def render(self) -> List[str]:
+       return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.type_name}'] + self.samples()
+
+
+class Counter(Metric):
+   type_name = 'counter'
+
+   def inc(self, *labels, amount: float = 1.0) -> None:
+       key = self._key(labels)
+       with self._lock:
+           self._values[key] = self._values.get(key, 0.0) + amount
+
+   def samples(self) -> List[str]:
+       with self._lock:
+           items = list(self._values.items())
+       return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}' for key, value in items]
+
+
+class Gauge(Metric):
+   """Set directly, or computed at scrape time by ``fn`` returning {label tuple: value}"""
+
+   type_name = 'gauge'
+
+   def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                fn: Optional[Callable[[], Dict[Tuple, float]]] = None):
+       super().__init__(name, help_text, label_names)
+       self.fn = fn
+
+   def set(self, value: float, *labels) -> None:
+       key = self._key(labels)
+       with self._lock:
+           self._values[key] = value
+
+   def inc(self, *labels, amount: float = 1.0) -> None:
+       key = self._key(labels)
+       with self._lock:
+           self._values[key] = self._values.get(key, 0.0) + amount
+
+   def dec(self, *labels, amount: float = 1.0) -> None:
+       self.inc(*labels, amount=-amount)
+
+   def samples(self) -> List[str]:
+       if self.fn is not None:
+           items = [(self._key(key if isinstance(key, tuple) else (key,)), value) for key, value in self.fn().items()]
+       else:
+           with self._lock:
+               items = list(self._values.items())
+       return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}' for key, value in items]
+
+
+class Histogram(Metric):
+   type_name = 'histogram'
+
+   def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                buckets: Sequence[float] = DEFAULT_BUCKETS):
+       super().__init__(name, help_text, label_names)
+       self.buckets = tuple(sorted(buckets))
+
+   def observe(self, value: float, *labels) -> None:
+       key = self._key(labels)
+       with self._lock:
+           state = self._values.get(key)
+           if state is None:
+               # Per-bucket counts (non-cumulative), then sum and count
+               state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+           for index, bound in enumerate(self.buckets):
+               if value <= bound:
+                   state[0][index] += 1
+                   break
+           state[1] += value
+           state[2] += 1
+
+   def samples(self) -> List[str]:
+       with self._lock:
+           items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+       lines = []
+       for key, (counts, total, count) in items:
+           cumulative = 0
+           for bound, bucket_count in zip(self.buckets, counts):
+               cumulative += bucket_count
+               le = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+               lines.append(f'{self.name}_bucket{le} {cumulative}')
+           lines.append(f'{self.name}_bucket{_format_labels(self.label_names, key, INF_BUCKET)} {count}')
+           labels = _format_labels(self.label_names, key)
+           lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+           lines.append(f'{self.name}_count{labels} {count}')
+       return lines
+
+
+class MetricsRegistry:
+   def __init__(self):
+       self._metrics: Dict[str, Metric] = {}
+       self._lock = threading.Lock()
+
+   def register(self, metric: Metric) -> Metric:
+       with self._lock:
+           # Re-registering returns the existing family so module reloads stay idempotent
+           return self._metrics.setdefault(metric.name, metric)
+
+   def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+       return self.register(Counter(name, help_text, label_names))
+
+   def gauge(self, name: str, help_text: str, label_names: Sequence[str] = (), fn=None) -> Gauge:
+       return self.register(Gauge(name, help_text, label_names, fn))
+
+   def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+       return self.register(Histogram(name, help_text, label_names, buckets))
+
+   def remove_label(self, label_name: str, value: str) -> None:
+       """Forget a label value (e.g. an evicted camera) across every family that has it"""
+       with self._lock:
+           metrics = list(self._metrics.values())
+       for metric in metrics:
+           if label_name in metric.label_names:
+               metric.remove(label_name, value)
+
+   def render(self) -> str:
+       with self._lock:
+           metrics = list(self._metrics.values())
+       lines = []
+       for metric in metrics:
+           try:
+               lines.extend(metric.render())
+           except Exception:
+               # A failing scrape-time gauge must not take the rest of the page down
+               continue
+       return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Pipeline metrics recorded by ThreatDetectionSystem, labeled per camera session.
+# The 'frame' stage is the end-to-end time for one frame.
+STAGE_SECONDS = REGISTRY.histogram(
+   'safeai_stage_seconds', 'Time spent in each detection pipeline stage', ('stage', 'camera'))
+FRAMES = REGISTRY.counter(
+   'safeai_frames_total', 'Frames received, by how they were handled', ('camera', 'outcome'))
+CACHE_LOOKUPS = REGISTRY.counter(
+   'safeai_result_cache_lookups_total', 'Result cache lookups', ('camera', 'result'))
+DETECTIONS = REGISTRY.counter(
+   'safeai_detections_total', 'Threats returned by model runs', ('camera', 'level'))
+
+
+def observe_stage(name: str, seconds: float) -> None:
+   """stages observer feeding STAGE_SECONDS; model work on shared workers has no single camera"""
+   STAGE_SECONDS.observe(seconds, name, current_camera() or 'shared')
+
+
+def forget_camera(camera_id: str) -> None:
+   """Drop an evicted camera's series so label cardinality follows the live sessions"""
+   REGISTRY.remove_label('camera', camera_id)
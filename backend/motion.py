@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+
+
+class MotionDetector:
+   """Cheap per-camera change detector using background subtraction on a thumbnail.
+
+   Frames are shrunk to ``width`` pixels wide and compared against a running
+   average background. The score is the fraction of thumbnail pixels that differ
+   from the background by more than ``pixel_threshold`` gray levels.
+   """
+
+   __slots__ = ("width", "alpha", "pixel_threshold", "background", "last_mask")
+
+   def __init__(self, width: int = 64, alpha: float = 0.05, pixel_threshold: int = 25):
+       self.width = width
+       self.alpha = alpha
+       self.pixel_threshold = pixel_threshold
+       self.background = None
+       self.last_mask = None
+
+   def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+       height, width = frame.shape[:2]
+       size = (self.width, max(1, round(height * self.width / width)))
+       # Shrink before the color conversion so cvtColor only touches the thumbnail
+       small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+       if small.ndim == 3:
+           small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+       return cv2.GaussianBlur(small, (3, 3), 0)
+
+   def update(self, frame: np.ndarray) -> float:
+       """Score the frame against the background, then fold it into the background"""
+       small = self._thumbnail(frame)
+       if self.background is None or self.background.shape != small.shape:
+           # First frame (or a resolution change) counts as a full scene change
+           self.background = small.astype(np.float32)
+           self.last_mask = np.ones(small.shape, dtype=bool)
+           return 1.0
+       diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+       self.last_mask = diff > self.pixel_threshold
+       cv2.accumulateWeighted(small, self.background, self.alpha)
+       return float(self.last_mask.mean())
+
+   def reset(self) -> None:
+       self.background = None
+       self.last_mask = None
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Dict, List
+
+import cv2
+
+from boxes import match_threats
+from detectweapons import ThreatDetectionSystem
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def load_images(image_dir: str, detector: ThreatDetectionSystem):
+   """Read the fixed image set in sorted order and preprocess it exactly like live frames"""
+   names = sorted(n for n in os.listdir(image_dir) if n.lower().endswith(IMAGE_EXTENSIONS))
+   if not names:
+       raise SystemExit(f"No images found in {image_dir}")
+   return names, [detector.prepare_image(cv2.imread(os.path.join(image_dir, n))) for n in names]
+
+
+def run_mode(precision: str, image_dir: str) -> Dict:
+   """Detect threats on every image with one precision mode and time it"""
+   detector = ThreatDetectionSystem(precision=precision)
+   names, images = load_images(image_dir, detector)
+   detector.warmup()
+   results, start_time = {}, time.time()
+   for name, image in zip(names, images):
+       results[name] = detector.postprocess(detector.detect_batch([image])[0]).to_threats(detector.threat_queries)
+   elapsed = time.time() - start_time
+   return {
+       'precision': detector.precision,
+       'seconds_per_image': elapsed / len(names),
+       'results': results,
+   }
+
+
+def compare(baseline: Dict, candidate: Dict, iou_threshold: float) -> Dict:
+   """Box-level recall/precision and mean IoU of a candidate run against the fp32 baseline"""
+   ref_total = cand_total = matched = 0
+   iou_sum = 0.0
+   for name, ref in baseline['results'].items():
+       cand = candidate['results'].get(name, [])
+       matches = match_threats(ref, cand, iou_threshold)
+       ref_total += len(ref)
+       cand_total += len(cand)
+       matched += len(matches)
+       iou_sum += sum(iou for _, _, iou in matches)
+   return {
+       'precision': candidate['precision'],
+       'baseline_boxes': ref_total,
+       'candidate_boxes': cand_total,
+       'recall': matched / ref_total if ref_total else 1.0,
+       'box_precision': matched / cand_total if cand_total else 1.0,
+       'mean_iou': iou_sum / matched if matched else (1.0 if ref_total == 0 else 0.0),
+       'speedup': baseline['seconds_per_image'] / candidate['seconds_per_image'] if candidate['seconds_per_image'] else 0.0,
+   }
+
+
+def main(argv: List[str] = None) -> int:
+   parser = argparse.ArgumentParser(description="Compare a reduced-precision mode against the fp32 baseline")
+   parser.add_argument('image_dir', help="Directory with the fixed evaluation image set")
+   parser.add_argument('--precision', required=True, choices=['bf16', 'fp16', 'int8'])
+   parser.add_argument('--baseline', help="JSON file to reuse (or save) the fp32 baseline run")
+   parser.add_argument('--iou', type=float, default=0.5, help="IoU needed for a box to count as matched")
+   parser.add_argument('--min-recall', type=float, default=0.9)
+   parser.add_argument('--min-precision', type=float, default=0.9,
+                       help="Share of candidate boxes that must match a baseline box")
+   parser.add_argument('--min-iou', type=float, default=0.75)
+   args = parser.parse_args(argv)
+
+   if args.baseline and os.path.exists(args.baseline):
+       with open(args.baseline) as f:
+           baseline = json.load(f)
+   else:
+       baseline = run_mode('fp32', args.image_dir)
+       if args.baseline:
+           with open(args.baseline, 'w') as f:
+               json.dump(baseline, f)
+
+   report = compare(baseline, run_mode(args.precision, args.image_dir), args.iou)
+   print(json.dumps(report, indent=2))
+   if report['precision'] != args.precision:
+       # The device fell back to another mode, so the comparison says nothing about the requested one
+       logger.error("Requested %s but this device ran %s", args.precision, report['precision'])
+       return 1
+   if (report['recall'] < args.min_recall or report['box_precision'] < args.min_precision
+           or report['mean_iou'] < args.min_iou):
+       logger.error("%s is outside the accuracy bounds", report['precision'])
+       return 1
+   return 0
+
+
+if __name__ == '__main__':
+   sys.exit(main())
@@ -0,0 +1,169 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from boxes import THREAT_LEVELS, LEVEL_RANK
+
+
+def threat_level(threats: List[Dict]) -> str:
+   """Highest threat level among a camera's detections; unknown levels count as HIGH"""
+   rank = max((LEVEL_RANK.get(t.get('level'), LEVEL_RANK['HIGH']) for t in threats), default=0)
+   return THREAT_LEVELS[rank]
+
+
+def detections_signature(threats: List[Dict]) -> tuple:
+   """What a subscriber would see change: types, levels, tracks and whole-pixel boxes"""
+   return tuple(
+       (t['type'], t.get('level'), t.get('track_id'), tuple(round(v) for v in t['bbox'])) for t in threats
+   )
+
+
+class Subscription:
+   """Pending events for one client, coalesced per camera so a slow reader never grows a backlog.
+
+   Only the newest detections for each camera are kept. Consecutive level
+   transitions collapse into one event from the level the client last saw to the
+   current one, so a client that falls behind still receives every alert state
+   it has not caught up with, just not every intermediate frame.
+   """
+
+   def __init__(self, camera_ids: Optional[Iterable[str]] = None):
+       self.camera_ids = set(camera_ids) if camera_ids else None
+       self.coalesced = 0
+       self.closed = False
+       self._pending: "OrderedDict[tuple, Dict]" = OrderedDict()
+       self._cond = threading.Condition()
+
+   def wants(self, camera_id: str) -> bool:
+       return self.camera_ids is None or camera_id in self.camera_ids
+
+   def push(self, event: Dict) -> None:
+       key = (event['event'], event['camera_id'])
+       with self._cond:
+           previous = self._pending.pop(key, None)
+           if previous is not None:
+               self.coalesced += 1
+               if event['event'] == 'level':
+                   event = {**event, 'previous_level': previous['previous_level']}
+                   if event['level'] == event['previous_level']:
+                       # Flickered back before the client read it: nothing to report
+                       return
+           self._pending[key] = event
+           self._cond.notify()
+
+   def get(self, timeout: Optional[float] = None) -> List[Dict]:
+       """Drain pending events in arrival order; [] on timeout or close"""
+       with self._cond:
+           if not self._pending and not self.closed:
+               self._cond.wait(timeout)
+           events = list(self._pending.values())
+           self._pending.clear()
+           return events
+
+   def close(self) -> None:
+       with self._cond:
+           self.closed = True
+           self._cond.notify_all()
+
+   def __len__(self) -> int:
+       return len(self._pending)
+
+
+class ResultPublisher:
+   """Latest detection result per camera, pushed to subscribers only when it changes.
+
+   Each publish compares the detections against the camera's previous result.
+   Unchanged results update the stored timestamp and send nothing; changed ones
+   emit a ``detections`` event, plus a ``level`` event when the camera's highest
+   threat level moves.
+
+   ``max_subscribers`` caps open subscriptions, since each one ties up an HTTP
+   thread for as long as its client stays connected.
+   """
+
+   def __init__(self, max_subscribers: Optional[int] = None):
+       self.max_subscribers = max_subscribers
+       self.rejected = 0
+       self._latest: Dict[str, Dict] = {}
+       self._signatures: Dict[str, tuple] = {}
+       self._subscriptions: List[Subscription] = []
+       self._lock = threading.Lock()
+       self.published = 0
+       self.events = 0
+
+   def publish(self, camera_id: str, threats: List[Dict]) -> Dict:
+       now = time.time()
+       level = threat_level(threats)
+       signature = detections_signature(threats)
+       with self._lock:
+           self.published += 1
+           previous = self._latest.get(camera_id)
+           result = {'camera_id': camera_id, 'threats': threats, 'level': level, 'timestamp': now}
+           self._latest[camera_id] = result
+           if previous is not None and signature == self._signatures.get(camera_id):
+               return result
+           self._signatures[camera_id] = signature
+
+           events = [dict(result, event='detections')]
+           previous_level = previous['level'] if previous is not None else 'NORMAL'
+           if level != previous_level:
+               events.append({
+                   'event': 'level',
+                   'camera_id': camera_id,
+                   'level': level,
+                   'previous_level': previous_level,
+                   'timestamp': now
+               })
+           self.events += len(events)
+           # Pushing under the lock keeps each camera's events in publish order
+           for subscription in self._subscriptions:
+               if subscription.wants(camera_id):
+                   for event in events:
+                       subscription.push(event)
+       return result
+
+   def forget(self, camera_id: str) -> None:
+       """Drop a camera's stored result, e.g. when its detector session is evicted"""
+       with self._lock:
+           self._latest.pop(camera_id, None)
+           self._signatures.pop(camera_id, None)
+
+   def latest(self, camera_id: str) -> Optional[Dict]:
+       with self._lock:
+           return self._latest.get(camera_id)
+
+   def subscribe(self, camera_ids: Optional[Iterable[str]] = None) -> Subscription:
+       """New subscription, primed with the current detections of every camera it covers.
+
+       Raises RuntimeError when ``max_subscribers`` subscriptions are already open.
+       """
+       subscription = Subscription(camera_ids)
+       with self._lock:
+           if self.max_subscribers is not None and len(self._subscriptions) >= self.max_subscribers:
+               self.rejected += 1
+               raise RuntimeError(f"At most {self.max_subscribers} event subscriptions can be open at once")
+           for camera_id, result in self._latest.items():
+               if subscription.wants(camera_id):
+                   subscription.push(dict(result, event='detections'))
+           self._subscriptions.append(subscription)
+       return subscription
+
+   def unsubscribe(self, subscription: Subscription) -> None:
+       subscription.close()
+       with self._lock:
+           if subscription in self._subscriptions:
+               self._subscriptions.remove(subscription)
+
+   def stats(self) -> Dict:
+       with self._lock:
+           return {
+               'cameras': len(self._latest),
+               'subscribers': len(self._subscriptions),
+               'max_subscribers': self.max_subscribers,
+               'rejected': self.rejected,
+               'published': self.published,
+               'events': self.events,
+               'pending': sum(len(s) for s in self._subscriptions),
+               'coalesced': sum(s.coalesced for s in self._subscriptions),
+           }
@@ -0,0 +1,121 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from boxes import Detections
+
+
+class _CacheEntry:
+   __slots__ = ("session_id", "fingerprint", "threats", "timestamp", "nbytes")
+
+   def __init__(self, session_id: str, fingerprint: np.ndarray, threats: Detections, timestamp: float, nbytes: int):
+       self.session_id = session_id
+       self.fingerprint = fingerprint
+       self.threats = threats
+       self.timestamp = timestamp
+       self.nbytes = nbytes
+
+
+class DetectionCache:
+   """Bounded LRU/TTL cache of detections keyed on a downsampled frame fingerprint.
+
+   A fingerprint is an area-averaged grayscale thumbnail of the frame. Averaging
+   washes out sensor noise, so two frames of a static scene match when no
+   thumbnail cell differs by more than max_diff gray levels, while a person or
+   object entering the scene moves at least one cell past the threshold.
+   Entries are scoped to the camera session that produced them.
+   """
+
+   def __init__(self, ttl: float = 2.0, max_entries: int = 1024,
+                max_bytes: int = 8 * 1024 * 1024, thumb_size: int = 16,
+                max_diff: int = 12):
+       self.ttl = ttl
+       self.max_entries = max_entries
+       self.max_bytes = max_bytes
+       self.thumb_size = thumb_size
+       self.max_diff = max_diff
+       self._entries: "OrderedDict[int, _CacheEntry]" = OrderedDict()
+       self._by_session: Dict[str, Dict[int, _CacheEntry]] = {}
+       self._next_key = 0
+       self._bytes = 0
+       self._lock = threading.Lock()
+       self.hits = 0
+       self.misses = 0
+       self.evictions = 0
+       self.expirations = 0
+
+   def fingerprint(self, frame: np.ndarray) -> np.ndarray:
+       """Downsample a BGR or grayscale frame to a thumb_size x thumb_size gray thumbnail"""
+       gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+       thumb = cv2.resize(gray, (self.thumb_size, self.thumb_size), interpolation=cv2.INTER_AREA)
+       return thumb.astype(np.int16)
+
+   def get(self, session_id: str, fingerprint: np.ndarray, now: Optional[float] = None) -> Optional[Detections]:
+       """Return cached threats for a similar frame from the same session, or None"""
+       now = time.time() if now is None else now
+       with self._lock:
+           best_key, best_diff = None, None
+           for key, entry in list(self._by_session.get(session_id, {}).items()):
+               if now - entry.timestamp >= self.ttl:
+                   self._remove(key)
+                   self.expirations += 1
+                   continue
+               if entry.fingerprint.shape != fingerprint.shape:
+                   continue
+               diff = int(np.abs(entry.fingerprint - fingerprint).max())
+               if diff <= self.max_diff and (best_diff is None or diff < best_diff):
+                   best_key, best_diff = key, diff
+           if best_key is None:
+               self.misses += 1
+               return None
+           self._entries.move_to_end(best_key)
+           self.hits += 1
+           return self._entries[best_key].threats
+
+   def put(self, session_id: str, fingerprint: np.ndarray, threats: Detections, now: Optional[float] = None) -> None:
+       """Store threats for a frame, evicting least recently used entries past the caps"""
+       now = time.time() if now is None else now
+       # Arrays plus a fixed allowance for the entry and array object headers
+       nbytes = fingerprint.nbytes + threats.nbytes + 400
+       with self._lock:
+           key = self._next_key
+           self._next_key += 1
+           entry = _CacheEntry(session_id, fingerprint, threats, now, nbytes)
+           self._entries[key] = entry
+           self._by_session.setdefault(session_id, {})[key] = entry
+           self._bytes += nbytes
+           while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+               oldest_key = next(iter(self._entries))
+               self._remove(oldest_key)
+               self.evictions += 1
+
+   def _remove(self, key: int) -> None:
+       entry = self._entries.pop(key)
+       self._bytes -= entry.nbytes
+       session_entries = self._by_session.get(entry.session_id)
+       if session_entries is not None:
+           session_entries.pop(key, None)
+           if not session_entries:
+               del self._by_session[entry.session_id]
+
+   def clear(self) -> None:
+       with self._lock:
+           self._entries.clear()
+           self._by_session.clear()
+           self._bytes = 0
+
+   def stats(self) -> Dict:
+       """Hit/miss/eviction counters and current size"""
+       with self._lock:
+           return {
+               'entries': len(self._entries),
+               'bytes': self._bytes,
+               'hits': self.hits,
+               'misses': self.misses,
+               'evictions': self.evictions,
+               'expirations': self.expirations,
+           }
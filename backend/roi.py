@@ -0,0 +1,71 @@
+from typing import List, Sequence
+
+import cv2
+import numpy as np
+
+
+def motion_regions(mask: np.ndarray, frame_width: int, frame_height: int, min_cells: int = 2) -> List[List[float]]:
+   """Bounding boxes, in frame pixels, of the connected blobs in a thumbnail motion mask"""
+   count, _, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+   scale_x = frame_width / mask.shape[1]
+   scale_y = frame_height / mask.shape[0]
+   regions = []
+   for x, y, w, h, area in stats[1:count]:
+       # Ignore single-cell specks left over from sensor noise
+       if area < min_cells:
+           continue
+       regions.append([x * scale_x, y * scale_y, (x + w) * scale_x, (y + h) * scale_y])
+   return regions
+
+
+def _fit_window(box: Sequence[float], window_size: int, frame_width: int, frame_height: int) -> List[float]:
+   """Grow a box to at least window_size on each side and shift it inside the frame"""
+   cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+   width = min(max(box[2] - box[0], window_size), frame_width)
+   height = min(max(box[3] - box[1], window_size), frame_height)
+   x0 = min(max(0, cx - width / 2), frame_width - width)
+   y0 = min(max(0, cy - height / 2), frame_height - height)
+   return [x0, y0, x0 + width, y0 + height]
+
+
+def _overlaps(a: Sequence[float], b: Sequence[float]) -> bool:
+   return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _union(a: Sequence[float], b: Sequence[float]) -> List[float]:
+   return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+
+
+def plan_windows(regions: List[Sequence[float]], frame_width: int, frame_height: int,
+                 window_size: int, max_windows: int, padding: float = 0.25) -> List[List[int]]:
+   """Turn regions of interest into at most max_windows non-overlapping crop windows.
+
+   Each region is padded for context and grown to at least the model's native
+   input size, so small objects are seen at full resolution instead of being
+   upscaled. Overlapping windows are merged; if more than max_windows remain,
+   they collapse into a single window covering all of them.
+   """
+   windows = []
+   for x0, y0, x1, y1 in regions:
+       pad_x, pad_y = (x1 - x0) * padding, (y1 - y0) * padding
+       windows.append(_fit_window([x0 - pad_x, y0 - pad_y, x1 + pad_x, y1 + pad_y], window_size, frame_width, frame_height))
+
+   merged = True
+   while merged:
+       merged = False
+       for i in range(len(windows)):
+           for j in range(i + 1, len(windows)):
+               if _overlaps(windows[i], windows[j]):
+                   windows[i] = _fit_window(_union(windows[i], windows[j]), window_size, frame_width, frame_height)
+                   del windows[j]
+                   merged = True
+                   break
+           if merged:
+               break
+
+   if len(windows) > max_windows:
+       union = windows[0]
+       for window in windows[1:]:
+           union = _union(union, window)
+       windows = [_fit_window(union, window_size, frame_width, frame_height)]
+   return [[int(round(v)) for v in window] for window in windows]
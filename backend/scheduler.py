@@ -0,0 +1,142 @@
+import threading
+import time
+import queue
+import logging
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+BatchFn = Callable[[List[Any]], List[Any]]
+
+
+class InferenceScheduler:
+   """Queue between request threads and the detection model workers.
+
+   Callers submit one item and get a Future back. Worker threads drain the
+   queue, collecting up to max_batch_size items or waiting at most max_wait_ms
+   after the first one arrives, and hand the whole batch to a batch function.
+   Pass a list of batch functions to run a pool of model workers, one thread
+   per function, all fed from the same queue.
+
+   Moondream encodes and queries one image per call, so a batch function loops
+   over its items. The scheduler serializes access to each model and spreads
+   frames across workers, but it does not batch the compute. More frames per
+   second come from more workers (MODEL_WORKERS or CPU_REPLICAS), not from
+   bigger batches.
+   """
+
+   def __init__(self, batch_fn: Union[BatchFn, Sequence[BatchFn]],
+                max_batch_size: int = 8, max_wait_ms: float = 20.0,
+                max_queue_size: int = 256):
+       self.batch_fns = [batch_fn] if callable(batch_fn) else list(batch_fn)
+       self.max_batch_size = max(1, max_batch_size)
+       self.max_wait = max_wait_ms / 1000.0
+       self._queue = queue.Queue(maxsize=max_queue_size)
+       self._stats_lock = threading.Lock()
+       self._batches = 0
+       self._frames = 0
+       self._max_batch_seen = 0
+       self._last_batch_size = 0
+       self._last_batch_time = 0.0
+       self._errors = 0
+       self._running = True
+       self._workers = []
+       for index, fn in enumerate(self.batch_fns):
+           worker = threading.Thread(target=self._run, args=(fn,), name=f"inference-worker-{index}", daemon=True)
+           worker.start()
+           self._workers.append(worker)
+
+   def submit(self, item: Any) -> Future:
+       """Queue an item for the next batch; blocks if the queue is full"""
+       if not self._running:
+           raise RuntimeError("Inference scheduler is stopped")
+       future = Future()
+       self._queue.put((item, future))
+       if not self._running:
+           # stop() ran while this put was in flight and its drain may have missed it
+           self._fail_pending()
+       return future
+
+   def _collect_batch(self) -> List:
+       """Block for the first item, then gather more until the batch or time window fills.
+
+       Items already queued are always taken, so a zero wait still batches a backlog.
+       """
+       batch = [self._queue.get()]
+       deadline = time.monotonic() + self.max_wait
+       while len(batch) < self.max_batch_size:
+           remaining = deadline - time.monotonic()
+           try:
+               if remaining > 0:
+                   batch.append(self._queue.get(timeout=remaining))
+               else:
+                   batch.append(self._queue.get_nowait())
+           except queue.Empty:
+               break
+       return batch
+
+   def _run(self, batch_fn: BatchFn) -> None:
+       while self._running:
+           batch = [entry for entry in self._collect_batch() if entry is not None]
+           if not batch:
+               continue
+           items = [item for item, _ in batch]
+           start_time = time.time()
+           try:
+               results = batch_fn(items)
+               for (_, future), result in zip(batch, results):
+                   future.set_result(result)
+           except Exception as e:
+               logger.error("Error running inference batch of %d: %s", len(batch), e)
+               with self._stats_lock:
+                   self._errors += 1
+               for _, future in batch:
+                   if not future.done():
+                       future.set_exception(e)
+           with self._stats_lock:
+               self._batches += 1
+               self._frames += len(batch)
+               self._last_batch_size = len(batch)
+               self._max_batch_seen = max(self._max_batch_seen, len(batch))
+               self._last_batch_time = time.time() - start_time
+
+   def stats(self) -> Dict:
+       """Queue depth and batch-size statistics"""
+       with self._stats_lock:
+           return {
+               'queue_depth': self._queue.qsize(),
+               'batches': self._batches,
+               'frames': self._frames,
+               'avg_batch_size': self._frames / self._batches if self._batches else 0.0,
+               'max_batch_size_seen': self._max_batch_seen,
+               'last_batch_size': self._last_batch_size,
+               'last_batch_seconds': self._last_batch_time,
+               'errors': self._errors,
+               'workers': len(self._workers),
+               'max_batch_size': self.max_batch_size,
+               'max_wait_ms': self.max_wait * 1000.0,
+           }
+
+   def _fail_pending(self) -> None:
+       """Fail every queued future so callers blocked on result() return"""
+       while True:
+           try:
+               entry = self._queue.get_nowait()
+           except queue.Empty:
+               return
+           if entry is not None and not entry[1].done():
+               entry[1].set_exception(RuntimeError("Inference scheduler is stopped"))
+
+   def stop(self) -> None:
+       """Stop the workers after the batch in progress and fail everything still queued"""
+       self._running = False
+       self._fail_pending()
+       # Wake workers blocked waiting for their first item
+       for _ in self._workers:
+           try:
+               self._queue.put_nowait(None)
+           except queue.Full:
+               break
@@ -0,0 +1,43 @@
+import os
+import logging
+from dotenv import load_dotenv
+from waitress import serve
+
+import app as safeai
+from structured_logging import configure_logging
+
+
+# Load environment variables
+load_dotenv()
+
+
+# Configure logging
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+def create_app():
+   """Start loading the model in the background and return the Flask app for any threaded WSGI server.
+
+   Run a single server process with many threads (e.g. ``gunicorn -w 1 --threads 32
+   'serve:create_app()'``); HTTP threads only queue frames, and the model workers
+   configured by MODEL_WORKERS do all inference. /api/health reports the load state.
+   """
+   safeai.start_detector()
+   return safeai.app
+
+
+def main() -> None:
+   """Production entry point: multi-threaded waitress front end over the shared model workers"""
+   port = int(os.getenv('PORT', 8000))
+   threads = int(os.getenv('HTTP_THREADS', 32))
+   application = create_app()
+   logger.info("Serving on port %d with %d HTTP threads", port, threads)
+   try:
+       serve(application, host=os.getenv('HOST', '0.0.0.0'), port=port, threads=threads)
+   finally:
+       safeai.shutdown_detector()
+
+
+if __name__ == '__main__':
+   main()
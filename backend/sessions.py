@@ -0,0 +1,118 @@
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional
+from motion import MotionDetector
+from tracker import BoxTracker
+
+
+logger = logging.getLogger(__name__)
+
+
+# Session used when a client does not send a camera id
+DEFAULT_SESSION_ID = "default"
+
+
+class CameraSession:
+   """Throttle state and last results for a single camera stream"""
+
+   __slots__ = (
+       "session_id",
+       "last_process_time",
+       "last_detections",
+       "motion",
+       "tracker",
+       "last_motion_score",
+       "detections_signature",
+       "detections_version",
+       "annotated_jpeg",
+       "annotated_version",
+       "last_seen",
+       "lock",
+   )
+
+   def __init__(self, session_id: str):
+       self.session_id = session_id
+       self.last_process_time = 0
+       self.last_detections: List[Dict] = []
+       # Gates model calls on scene change instead of a fixed frame count
+       self.motion = MotionDetector()
+       self.last_motion_score = 0.0
+       # Keeps boxes moving with stable ids between model runs
+       self.tracker = BoxTracker()
+       # Version bumps whenever the detected boxes change; the annotated JPEG is
+       # re-rendered only when its version falls behind
+       self.detections_signature = ()
+       self.detections_version = 0
+       self.annotated_jpeg: Optional[bytes] = None
+       self.annotated_version = -1
+       self.last_seen = time.time()
+       # Serializes frames from the same camera so throttle decisions stay consistent
+       self.lock = threading.Lock()
+
+
+class SessionRegistry:
+   """Thread-safe map of camera id -> CameraSession with idle eviction"""
+
+   def __init__(self, idle_timeout: float = 300.0, max_sessions: int = 256,
+                on_evict: Optional[Callable[[str], None]] = None):
+       self.idle_timeout = idle_timeout
+       self.max_sessions = max_sessions
+       # Called with the camera id of every evicted session, e.g. to drop its metric series
+       self._evict_listeners: List[Callable[[str], None]] = [on_evict] if on_evict is not None else []
+       self._sessions: Dict[str, CameraSession] = {}
+       self._lock = threading.Lock()
+       self._last_sweep = time.time()
+
+   def get(self, session_id: Optional[str] = None) -> CameraSession:
+       """Return the session for a camera, creating it on first use"""
+       session_id = str(session_id) if session_id else DEFAULT_SESSION_ID
+       now = time.time()
+       with self._lock:
+           # Sweep at most once per idle window to keep lookups cheap
+           if now - self._last_sweep >= self.idle_timeout:
+               self._evict_idle_locked(now)
+           session = self._sessions.get(session_id)
+           if session is None:
+               if len(self._sessions) >= self.max_sessions:
+                   self._evict_oldest_locked()
+               session = CameraSession(session_id)
+               self._sessions[session_id] = session
+           session.last_seen = now
+           return session
+
+   def evict_idle(self) -> int:
+       """Drop sessions that have not sent a frame within idle_timeout"""
+       with self._lock:
+           return self._evict_idle_locked(time.time())
+
+   def _evict_idle_locked(self, now: float) -> int:
+       self._last_sweep = now
+       stale = [sid for sid, s in self._sessions.items() if now - s.last_seen > self.idle_timeout]
+       for sid in stale:
+           self._remove_locked(sid)
+       if stale:
+           logger.info(f"Evicted {len(stale)} idle camera sessions")
+       return len(stale)
+
+   def _evict_oldest_locked(self) -> None:
+       oldest = min(self._sessions.values(), key=lambda s: s.last_seen)
+       self._remove_locked(oldest.session_id)
+
+   def add_evict_listener(self, listener: Callable[[str], None]) -> None:
+       """Also call ``listener`` with the camera id of every evicted session"""
+       with self._lock:
+           self._evict_listeners.append(listener)
+
+   def _remove_locked(self, session_id: str) -> None:
+       del self._sessions[session_id]
+       for listener in self._evict_listeners:
+           listener(session_id)
+
+   def session_ids(self) -> List[str]:
+       with self._lock:
+           return list(self._sessions)
+
+   def __len__(self) -> int:
+       with self._lock:
+           return len(self._sessions)
@@ -0,0 +1,98 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+
+# Observers called with (stage name, seconds) for every timed pipeline stage
+_observers: List[Callable[[str, float], None]] = []
+_observers_lock = threading.Lock()
+# Per-thread camera id and active trace, set by the request thread handling a frame
+_context = threading.local()
+
+
+def add_observer(observer: Callable[[str, float], None]) -> None:
+   with _observers_lock:
+       _observers.append(observer)
+
+
+def remove_observer(observer: Callable[[str, float], None]) -> None:
+   with _observers_lock:
+       if observer in _observers:
+           _observers.remove(observer)
+
+
+@contextmanager
+def camera(camera_id: str):
+   """Attribute stages timed on this thread to a camera session"""
+   previous = getattr(_context, 'camera', None)
+   _context.camera = camera_id
+   try:
+       yield
+   finally:
+       _context.camera = previous
+
+
+def current_camera() -> Optional[str]:
+   """Camera whose frame this thread is handling; None on shared inference workers"""
+   return getattr(_context, 'camera', None)
+
+
+@contextmanager
+def trace(enabled: bool = True):
+   """Collect a span for every stage timed on this thread, for per-request traces"""
+   previous = getattr(_context, 'trace', None)
+   spans: List[Dict] = []
+   _context.trace = (time.perf_counter(), spans) if enabled else None
+   try:
+       yield spans
+   finally:
+       _context.trace = previous
+
+
+@contextmanager
+def stage(name: str):
+   """Time a block of the detection pipeline and report it to every observer.
+
+   Costs two clock reads when nothing is observing, so the hooks stay in the
+   hot path permanently.
+   """
+   start = time.perf_counter()
+   try:
+       yield
+   finally:
+       active_trace = getattr(_context, 'trace', None)
+       if _observers or active_trace is not None:
+           elapsed = time.perf_counter() - start
+           for observer in list(_observers):
+               observer(name, elapsed)
+           if active_trace is not None:
+               trace_start, spans = active_trace
+               spans.append({
+                   'stage': name,
+                   'start_ms': (start - trace_start) * 1000.0,
+                   'duration_ms': elapsed * 1000.0
+               })
+
+
+class StageRecorder:
+   """Observer that keeps every sample per stage, for benchmarks and one-off profiling"""
+
+   def __init__(self):
+       self.samples: Dict[str, List[float]] = {}
+       self._lock = threading.Lock()
+
+   def __call__(self, name: str, seconds: float) -> None:
+       with self._lock:
+           self.samples.setdefault(name, []).append(seconds)
+
+   def __enter__(self) -> "StageRecorder":
+       add_observer(self)
+       return self
+
+   def __exit__(self, *exc) -> None:
+       remove_observer(self)
+
+   def reset(self) -> None:
+       with self._lock:
+           self.samples = {}
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from typing import Dict, Optional, Tuple
+
+from stages import current_camera
+
+
+# LogRecord attributes that are not user-supplied extra fields
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+   """One JSON object per line: time, level, logger, camera, message and any extra fields"""
+
+   def format(self, record: logging.LogRecord) -> str:
+       entry = {
+           'ts': round(record.created, 3),
+           'level': record.levelname,
+           'logger': record.name,
+           'msg': record.getMessage(),
+       }
+       for key, value in vars(record).items():
+           if key not in _RECORD_ATTRS and not key.startswith('_'):
+               entry[key] = value
+       if record.exc_info:
+           entry['exc'] = self.formatException(record.exc_info)
+       return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class CameraSampler(logging.Filter):
+   """Tags records with the camera being handled and rate-limits chatty ones per camera.
+
+   Records below WARNING are limited to ``rate`` per second for each camera and
+   message template, so one busy camera cannot drown out the others and a
+   steady per-frame message costs a dict lookup instead of a write. The next
+   record let through carries a ``suppressed`` count of what was dropped.
+   WARNING and above always pass.
+   """
+
+   def __init__(self, rate: float = 1.0, max_keys: int = 4096):
+       super().__init__()
+       self.rate = rate
+       self.max_keys = max_keys
+       self._buckets: Dict[Tuple[str, str], list] = {}
+       self._lock = threading.Lock()
+
+   def filter(self, record: logging.LogRecord) -> bool:
+       camera = getattr(record, 'camera', None) or current_camera()
+       if camera is not None:
+           record.camera = camera
+       if record.levelno >= logging.WARNING or self.rate <= 0:
+           return True
+       key = (camera or '-', str(record.msg))
+       now = time.monotonic()
+       with self._lock:
+           bucket = self._buckets.get(key)
+           if bucket is None:
+               if len(self._buckets) >= self.max_keys:
+                   self._buckets.clear()
+               # [tokens, last refill, suppressed since last emit]
+               bucket = self._buckets[key] = [max(1.0, self.rate), now, 0]
+           bucket[0] = min(max(1.0, self.rate), bucket[0] + (now - bucket[1]) * self.rate)
+           bucket[1] = now
+           if bucket[0] < 1.0:
+               bucket[2] += 1
+               return False
+           bucket[0] -= 1.0
+           if bucket[2]:
+               record.suppressed = bucket[2]
+               bucket[2] = 0
+       return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+   """QueueHandler that defers formatting to the listener thread and drops records when full"""
+
+   def __init__(self, log_queue: queue.Queue):
+       super().__init__(log_queue)
+       self.dropped = 0
+
+   def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+       # The stock prepare() formats on the calling thread; leave msg % args to the listener
+       return record
+
+   def enqueue(self, record: logging.LogRecord) -> None:
+       try:
+           self.queue.put_nowait(record)
+       except queue.Full:
+           self.dropped += 1
+
+
+def configure_logging(level: Optional[str] = None) -> None:
+   """Install the process-wide logging setup once; later calls are no-ops.
+
+   LOG_FORMAT=json switches to structured records, LOG_SAMPLE_RATE limits
+   INFO/DEBUG records per camera and message per second (0 disables sampling),
+   and LOG_ASYNC=0 writes synchronously instead of through the queue listener.
+   """
+   global _listener
+   with _configure_lock:
+       root = logging.getLogger()
+       if getattr(root, '_safeai_configured', False):
+           return
+       root._safeai_configured = True
+
+       stream_handler = logging.StreamHandler()
+       if os.getenv('LOG_FORMAT', 'text') == 'json':
+           stream_handler.setFormatter(JsonFormatter())
+       else:
+           stream_handler.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+
+       if os.getenv('LOG_ASYNC', '1') == '1':
+           log_queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+           handler = NonBlockingQueueHandler(log_queue)
+           _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+           _listener.start()
+           atexit.register(_listener.stop)
+       else:
+           handler = stream_handler
+       handler.addFilter(CameraSampler(rate=float(os.getenv('LOG_SAMPLE_RATE', 1.0))))
+
+       for existing in list(root.handlers):
+           root.removeHandler(existing)
+       root.addHandler(handler)
+       root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
@@ -0,0 +1,145 @@
+import math
+import itertools
+from typing import Dict, List, Set, Tuple
+
+from boxes import match_threats
+
+
+class Track:
+   """One tracked object: last confirmed box, per-second box velocity and smoothed confidence"""
+
+   __slots__ = ("track_id", "bbox", "velocity", "confidence", "type", "level", "last_update", "hits", "misses")
+
+   def __init__(self, track_id: int, threat: Dict, timestamp: float):
+       self.track_id = track_id
+       self.bbox = list(threat["bbox"])
+       self.velocity = [0.0, 0.0, 0.0, 0.0]
+       self.confidence = threat["confidence"]
+       self.type = threat["type"]
+       self.level = threat.get("level")
+       self.last_update = timestamp
+       self.hits = 1
+       self.misses = 0
+
+   def predict(self, timestamp: float, max_coast: float) -> List[float]:
+       """Constant-velocity box at a later time, extrapolating at most max_coast seconds"""
+       dt = min(max(timestamp - self.last_update, 0.0), max_coast)
+       return [b + v * dt for b, v in zip(self.bbox, self.velocity)]
+
+   def to_threat(self, bbox: List[float], timestamp: float) -> Dict:
+       return {
+           "bbox": bbox,
+           "confidence": self.confidence,
+           "type": self.type,
+           "level": self.level,
+           "track_id": self.track_id,
+           "timestamp": timestamp
+       }
+
+
+def box_center(bbox: List[float]) -> Tuple[float, float]:
+   return (bbox[0] + bbox[2]) / 2.0, (bbox[1] + bbox[3]) / 2.0
+
+
+def match_centers(tracks: List[Dict], detections: List[Dict], used_tracks: Set[int], used_detections: Set[int],
+                  max_distance: float) -> List[Tuple[int, int]]:
+   """Greedily pair leftover same-type boxes by center distance, in units of the track's box size.
+
+   Catches objects that moved far enough between model runs for the boxes to
+   stop overlapping, where IoU association cannot tell them apart from new ones.
+   """
+   pairs = []
+   for i, track in enumerate(tracks):
+       if i in used_tracks:
+           continue
+       tx, ty = box_center(track["bbox"])
+       size = max(track["bbox"][2] - track["bbox"][0], track["bbox"][3] - track["bbox"][1], 1e-6)
+       for j, detection in enumerate(detections):
+           if j in used_detections or detection["type"] != track["type"]:
+               continue
+           dx, dy = box_center(detection["bbox"])
+           distance = math.hypot(dx - tx, dy - ty) / size
+           if distance <= max_distance:
+               pairs.append((distance, i, j))
+   pairs.sort()
+   used_i, used_j, matches = set(), set(), []
+   for _, i, j in pairs:
+       if i not in used_i and j not in used_j:
+           used_i.add(i)
+           used_j.add(j)
+           matches.append((i, j))
+   return matches
+
+
+class BoxTracker:
+   """IoU-association tracker with constant-velocity propagation between model runs.
+
+   ``update`` folds in fresh model detections: each is matched to the predicted box of
+   an existing track of the same type, first by IoU and then, for boxes that no longer
+   overlap, by center distance. Unmatched detections start new tracks. Only tracks the
+   latest model run confirmed are returned; a missed track is kept out of sight for
+   ``max_misses`` runs so the object can pick its id back up.
+   ``predict`` moves every visible track along its velocity so boxes keep following
+   objects on frames where the model does not run.
+   """
+
+   __slots__ = ("tracks", "iou_threshold", "center_distance", "confidence_alpha", "velocity_alpha",
+                "max_misses", "max_coast", "_ids")
+
+   def __init__(self, iou_threshold: float = 0.3, center_distance: float = 1.5, confidence_alpha: float = 0.5,
+                velocity_alpha: float = 0.5, max_misses: int = 1, max_coast: float = 3.0):
+       self.tracks: List[Track] = []
+       self.iou_threshold = iou_threshold
+       self.center_distance = center_distance
+       self.confidence_alpha = confidence_alpha
+       self.velocity_alpha = velocity_alpha
+       self.max_misses = max_misses
+       self.max_coast = max_coast
+       self._ids = itertools.count(1)
+
+   def update(self, detections: List[Dict], timestamp: float) -> List[Dict]:
+       """Associate a new set of model detections with the tracks and return the tracked threats"""
+       predicted = [{"type": t.type, "bbox": t.predict(timestamp, self.max_coast)} for t in self.tracks]
+       matches = [(i, j) for i, j, _ in match_threats(predicted, detections, self.iou_threshold)]
+       matches += match_centers(predicted, detections, {i for i, _ in matches}, {j for _, j in matches},
+                                self.center_distance)
+       matched_tracks = set()
+       matched_detections = set()
+       for track_index, det_index in matches:
+           track = self.tracks[track_index]
+           detection = detections[det_index]
+           dt = timestamp - track.last_update
+           if dt > 0:
+               observed = [(n - o) / dt for n, o in zip(detection["bbox"], track.bbox)]
+               track.velocity = [self.velocity_alpha * v + (1 - self.velocity_alpha) * pv
+                                 for v, pv in zip(observed, track.velocity)]
+           track.bbox = list(detection["bbox"])
+           track.confidence = (self.confidence_alpha * detection["confidence"]
+                               + (1 - self.confidence_alpha) * track.confidence)
+           track.level = detection.get("level", track.level)
+           track.last_update = timestamp
+           track.hits += 1
+           track.misses = 0
+           matched_tracks.add(track_index)
+           matched_detections.add(det_index)
+
+       # Missed tracks stay hidden for re-association and are dropped after max_misses runs
+       survivors = []
+       for index, track in enumerate(self.tracks):
+           if index not in matched_tracks:
+               track.misses += 1
+               if track.misses > self.max_misses:
+                   continue
+           survivors.append(track)
+       for index, detection in enumerate(detections):
+           if index not in matched_detections:
+               survivors.append(Track(next(self._ids), detection, timestamp))
+       self.tracks = survivors
+       return self.predict(timestamp)
+
+   def predict(self, timestamp: float) -> List[Dict]:
+       """Current box of every track the last model run confirmed, propagated along its velocity"""
+       return [t.to_threat(t.predict(timestamp, self.max_coast), timestamp) for t in self.tracks if not t.misses]
+
+   def reset(self) -> None:
+       self.tracks = []
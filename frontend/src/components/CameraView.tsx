@@ -90,8 +90,8 @@ const CameraView: React.FC<CameraViewProps> = ({
       }
 
       processingRef.current = true;
-      const imageData = processingService.canvasToBase64(canvasRef.current);
-      const result = await processingService.processFrame(imageData);
+      const frame = await processingService.canvasToBlob(canvasRef.current);
+      const result = await processingService.processFrameBinary(frame, cameraId);
       
       // Always update threats and status
       setThreats(result.threats);
@@ -305,7 +305,7 @@ export class CameraProcessingManager {
 
         // Process the frame
         const imageData = this.processingService.canvasToBase64(camera.canvas);
-        const result = await this.processingService.processFrame(imageData);
+        const result = await this.processingService.processFrame(imageData, deviceId);
 
         // Store the processed frame with red boxes
         if (result.processed_image) {
@@ -13,14 +13,15 @@ export class ProcessingService {
   }
 
   // Process a single frame through the backend
-  public async processFrame(imageData: string): Promise<any> {
+  // cameraId keeps backend throttling and cached detections separate per stream
+  public async processFrame(imageData: string, cameraId?: string): Promise<any> {
     try {
       const response = await fetch(`${this.API_BASE_URL}/detect`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ image: imageData }),
+        body: JSON.stringify({ image: imageData, camera_id: cameraId }),
       });
 
       if (!response.ok) {
@@ -34,11 +35,75 @@ export class ProcessingService {
     }
   }
 
+  // Upload a raw JPEG frame; the response carries threats only, no processed image
+  public async processFrameBinary(frame: Blob, cameraId?: string): Promise<any> {
+    try {
+      const query = cameraId ? `?camera_id=${encodeURIComponent(cameraId)}` : '';
+      const response = await fetch(`${this.API_BASE_URL}/detect${query}`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'image/jpeg',
+        },
+        body: frame,
+      });
+
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      return await response.json();
+    } catch (error) {
+      console.error('Error processing frame:', error);
+      throw error;
+    }
+  }
+
+  // Encode canvas to a JPEG blob for binary upload
+  public canvasToBlob(canvas: HTMLCanvasElement): Promise<Blob> {
+    return new Promise((resolve, reject) => {
+      canvas.toBlob(blob => {
+        if (blob) {
+          resolve(blob);
+        } else {
+          reject(new Error('Failed to encode canvas'));
+        }
+      }, 'image/jpeg');
+    });
+  }
+
   // Convert canvas to base64
   public canvasToBase64(canvas: HTMLCanvasElement): string {
     return canvas.toDataURL('image/jpeg').split(',')[1];
   }
 
+  // Subscribe to pushed detection changes and threat-level transitions instead of polling
+  // Returns a function that closes the subscription
+  public subscribeToDetections(
+    cameraIds: string[] | null,
+    onDetections: (result: any) => void,
+    onLevelChange?: (transition: any) => void
+  ): () => void {
+    const query = cameraIds && cameraIds.length > 0
+      ? `?cameras=${encodeURIComponent(cameraIds.join(','))}`
+      : '';
+    const source = new EventSource(`${this.API_BASE_URL}/events${query}`);
+
+    source.addEventListener('detections', (event) => {
+      onDetections(JSON.parse((event as MessageEvent).data));
+    });
+    if (onLevelChange) {
+      source.addEventListener('level', (event) => {
+        onLevelChange(JSON.parse((event as MessageEvent).data));
+      });
+    }
+    source.onerror = (error) => {
+      // EventSource reconnects on its own using the server's retry interval
+      console.error('Detection event stream error:', error);
+    };
+
+    return () => source.close();
+  }
+
   public async checkHealth(): Promise<boolean> {
     try {
       const response = await fetch(`${this.API_BASE_URL}/health`);